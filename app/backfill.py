@@ -0,0 +1,78 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from . import storage, visit_store
+from .normalizer import NORMALIZER_VERSION, normalize_to_dartsmind
+
+
+def _renormalize_chunk(rows: List[Dict[str, Any]]) -> List[Tuple[int, str, str]]:
+    """Worker: (id, normalized_json, meta_json) for each stored row."""
+    out = []
+    for r in rows:
+        meta = json.loads(r["meta_json"] or "{}")
+        normalized = normalize_to_dartsmind(
+            json.loads(r["raw_json"] or "{}"),
+            json.loads(r["player_names"] or "[]"),
+            bool(r["bust"]),
+            meta=meta,
+        )
+        out.append((r["id"], json.dumps(normalized, ensure_ascii=False), r["meta_json"] or "{}"))
+    return out
+
+
+def _fmt_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}h{m:02d}m{s:02d}s" if h else f"{m}m{s:02d}s"
+
+
+def renormalize(workers: Optional[int]=None, chunk_size: int=500, report: Callable[[str], None]=print) -> int:
+    """
+    Re-run normalize_to_dartsmind over every ingest written by an older
+    NORMALIZER_VERSION. Rows are streamed out of SQLite in chunks, normalized
+    across a process pool and written back one transaction per chunk, with at
+    most 2 chunks per worker in flight. Interrupting is safe: finished chunks
+    carry the new version and are skipped on the next run.
+    Returns the number of rows updated.
+    """
+    workers = workers or os.cpu_count() or 1
+    total = storage.count_outdated(NORMALIZER_VERSION)
+    if total == 0:
+        report("Nothing to do: all ingests are at normalizer version %d." % NORMALIZER_VERSION)
+        return 0
+    report(f"Re-normalizing {total} ingests to version {NORMALIZER_VERSION} with {workers} workers...")
+
+    done = 0
+    updated = 0
+    started = time.monotonic()
+
+    def commit(results: List[Tuple[int, str, str]]) -> None:
+        nonlocal done, updated
+        saved = set(storage.save_renormalized([(i, n) for i, n, _ in results], NORMALIZER_VERSION))
+        # Rows skipped by the save were rewritten meanwhile, and so were their visits
+        visit_store.replace_ingests([(i, json.loads(n), json.loads(m)) for i, n, m in results if i in saved])
+        done += len(results)
+        updated += len(saved)
+        elapsed = time.monotonic() - started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (total - done) / rate if rate > 0 else 0.0
+        report(f"{done}/{total} rows  {rate:,.0f} rows/s  ETA {_fmt_duration(max(eta, 0))}")
+
+    in_flight: Deque[Future] = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in storage.iter_outdated(NORMALIZER_VERSION, chunk_size):
+            in_flight.append(pool.submit(_renormalize_chunk, chunk))
+            if len(in_flight) >= 2 * workers:
+                commit(in_flight.popleft().result())
+        while in_flight:
+            commit(in_flight.popleft().result())
+
+    elapsed = time.monotonic() - started
+    skipped = f", {done - updated} already rewritten" if done > updated else ""
+    report(f"Done: {updated} rows in {_fmt_duration(elapsed)} ({done / elapsed if elapsed else 0:,.0f} rows/s{skipped}).")
+    return updated
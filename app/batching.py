@@ -0,0 +1,254 @@
+import io
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
+
+from .config_store import load_config
+from .parseextract_client import REQUEST_TIMEOUT, ParseExtractError, call_parseextract, resolve_prompt
+
+# Tiles are scaled to fit this cell; the label band sits above each tile.
+TILE_MAX = (720, 1280)
+LABEL_HEIGHT = 72
+
+
+class _Pending:
+    __slots__ = ("image_bytes", "filename", "mime", "future", "enqueued")
+
+    def __init__(self, image_bytes: bytes, filename: str, mime: str) -> None:
+        self.image_bytes = image_bytes
+        self.filename = filename
+        self.mime = mime
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+
+
+def _tile_prompt(base_prompt: str, n: int) -> str:
+    return (
+        f"{base_prompt}\n\n"
+        f"This image is a grid of {n} separate screenshots. Each one has a label "
+        f"'TILE 1' .. 'TILE {n}' directly above it. Analyse every tile on its own and "
+        'return JSON of the form {"tiles": [{"tile": <label number>, ...fields above...}]} '
+        f"with exactly one entry per tile."
+    )
+
+
+def build_composite(images: List[bytes]) -> Tuple[bytes, List[int]]:
+    """
+    Tile decodable images into one labeled PNG grid.
+    Returns the PNG bytes and the input indices that made it into the composite.
+    """
+    decoded: List[Tuple[int, Image.Image]] = []
+    for i, b in enumerate(images):
+        try:
+            img = Image.open(io.BytesIO(b))
+            img.draft("RGB", TILE_MAX)
+            img = img.convert("RGB")
+        except (UnidentifiedImageError, OSError, ValueError):
+            continue
+        img.thumbnail(TILE_MAX)
+        decoded.append((i, img))
+    if not decoded:
+        return b"", []
+
+    cols = math.ceil(math.sqrt(len(decoded)))
+    rows = math.ceil(len(decoded) / cols)
+    cell_w = max(img.width for _, img in decoded)
+    cell_h = max(img.height for _, img in decoded) + LABEL_HEIGHT
+    sheet = Image.new("RGB", (cols * cell_w, rows * cell_h), "white")
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default(size=LABEL_HEIGHT - 16)
+    for n, (_, img) in enumerate(decoded):
+        x, y = (n % cols) * cell_w, (n // cols) * cell_h
+        draw.rectangle([x, y, x + cell_w - 1, y + LABEL_HEIGHT - 1], fill="black")
+        draw.text((x + 12, y + 8), f"TILE {n + 1}", fill="white", font=font)
+        sheet.paste(img, (x, y + LABEL_HEIGHT))
+
+    out = io.BytesIO()
+    sheet.save(out, "PNG", optimize=False)
+    return out.getvalue(), [i for i, _ in decoded]
+
+
+def split_tiles(resp: Dict[str, Any], n: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Map a composite response back to per-tile payloads, in tile order.
+    Returns None unless every tile 1..n is attributed exactly once.
+    """
+    tiles = None
+    for key in ["tiles", "output", "text", "data", "result", "extracted_data"]:
+        v = resp.get(key)
+        if key == "tiles" and isinstance(v, list):
+            tiles = v
+        elif isinstance(v, dict) and isinstance(v.get("tiles"), list):
+            tiles = v["tiles"]
+        if tiles is not None:
+            break
+    if tiles is None:
+        return None
+
+    by_label: Dict[int, Dict[str, Any]] = {}
+    for t in tiles:
+        if not isinstance(t, dict):
+            return None
+        try:
+            label = int(t.get("tile"))
+        except (TypeError, ValueError):
+            return None
+        if label in by_label or not 1 <= label <= n:
+            return None
+        by_label[label] = {k: v for k, v in t.items() if k != "tile"}
+    if len(by_label) != n:
+        return None
+    return [by_label[i] for i in range(1, n + 1)]
+
+
+class CompositeBatcher:
+    """
+    Collects uploads arriving within `window_ms` (up to `max_size`) and
+    extracts them with one ParseExtract call on a labeled composite image.
+    Falls back to individual calls when tiles cannot be attributed.
+    """
+
+    def __init__(self, max_size: int=4, window_ms: int=400, workers: int=4) -> None:
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pe-batch")
+        self._stats_lock = threading.Lock()
+        self.configure(max_size, window_ms)
+        threading.Thread(target=self._collect, name="pe-batch-collector", daemon=True).start()
+
+    def configure(self, max_size: int, window_ms: int) -> None:
+        """
+        Apply new settings in place; the next batch the collector starts uses
+        them. Stats restart so they describe the current settings.
+        """
+        settings = (max(1, int(max_size)), max(0, int(window_ms)) / 1000.0)
+        if settings == (getattr(self, "max_size", None), getattr(self, "window", None)):
+            return
+        self.max_size, self.window = settings
+        with self._stats_lock:
+            self._stats = {"uploads": 0, "requests": 0, "batches": 0, "fallbacks": 0, "wait_ms_total": 0.0}
+
+    def submit(self, image_bytes: bytes, filename: str, mime: str) -> Dict[str, Any]:
+        p = _Pending(image_bytes, filename, mime)
+        self._queue.put(p)
+        # One window of waiting, the composite request, then (if the tile
+        # can't be attributed) this upload's own request.
+        timeout = self.window + 2 * REQUEST_TIMEOUT
+        try:
+            return p.future.result(timeout=timeout)
+        except FutureTimeout:
+            raise ParseExtractError(f"No extraction for {filename} after {timeout:.0f}s") from None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            s = dict(self._stats)
+        s["requests_saved"] = s["uploads"] - s["requests"]
+        s["avg_added_wait_ms"] = round(s.pop("wait_ms_total") / s["uploads"], 1) if s["uploads"] else 0.0
+        s.update(max_size=self.max_size, window_ms=int(self.window * 1000))
+        return s
+
+    def _count(self, **inc: float) -> None:
+        with self._stats_lock:
+            for k, v in inc.items():
+                self._stats[k] += v
+
+    def _collect(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = batch[0].enqueued + self.window
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch: List[_Pending]) -> None:
+        try:
+            self._extract(batch)
+        finally:
+            # Whatever failed, no submitter is left waiting on its future
+            for p in batch:
+                if not p.future.done():
+                    p.future.set_exception(ParseExtractError("Batched extraction failed"))
+
+    def _extract(self, batch: List[_Pending]) -> None:
+        started = time.monotonic()
+        self._count(uploads=len(batch), wait_ms_total=sum((started - p.enqueued) * 1000 for p in batch))
+        if len(batch) == 1:
+            self._single(batch[0])
+            return
+
+        try:
+            composite, placed = build_composite([p.image_bytes for p in batch])
+            results: Optional[List[Dict[str, Any]]] = None
+            if len(placed) > 1:
+                self._count(requests=1, batches=1)
+                resp = call_parseextract(
+                    composite, "composite.png", mime="image/png",
+                    prompt=_tile_prompt(resolve_prompt(load_config()), len(placed)),
+                )
+                results = split_tiles(resp, len(placed))
+        except Exception:
+            results = None
+
+        if results is None:
+            self._count(fallbacks=1)
+            self._singles(batch)
+            return
+
+        for tile_no, (i, data) in enumerate(zip(placed, results), start=1):
+            p = batch[i]
+            p.future.set_result({"engine": "composite", "filename": p.filename, "tile": tile_no, "data": data})
+        self._singles([p for i, p in enumerate(batch) if i not in placed])
+
+    def _singles(self, pending: List[_Pending]) -> None:
+        """Individual calls for `pending`, side by side so each fits its submitter's timeout."""
+        threads = [threading.Thread(target=self._single, args=(p,), name="pe-batch-single") for p in pending[1:]]
+        for t in threads:
+            t.start()
+        if pending:
+            self._single(pending[0])
+        for t in threads:
+            t.join()
+
+    def _single(self, p: _Pending) -> None:
+        self._count(requests=1)
+        try:
+            p.future.set_result(call_parseextract(p.image_bytes, p.filename, mime=p.mime))
+        except Exception as e:
+            p.future.set_exception(e)
+
+
+_batcher: Optional[CompositeBatcher] = None
+_batcher_pid: Optional[int] = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher(max_size: int, window_ms: int) -> CompositeBatcher:
+    """
+    Process-wide batcher, reconfigured in place when settings change.
+    Recreated only after a fork, since its threads don't survive one.
+    """
+    global _batcher, _batcher_pid
+    with _batcher_lock:
+        if _batcher is None or _batcher_pid != os.getpid():
+            _batcher = CompositeBatcher(max_size=max_size, window_ms=window_ms)
+            _batcher_pid = os.getpid()
+        else:
+            _batcher.configure(max_size, window_ms)
+        return _batcher
+
+
+def call_batched(image_bytes: bytes, filename: str, mime: str, settings: Dict[str, Any]) -> Dict[str, Any]:
+    batcher = get_batcher(settings.get("max_size", 4), settings.get("window_ms", 400))
+    return batcher.submit(image_bytes, filename, mime)
@@ -9,7 +9,14 @@ DEFAULTS = {
     "api_key": None,
     "prompt": "Extract all dart game scores, player names, and round information from this image. Format as JSON with fields: rounds, scores, players.",
     "extra_params": {},   # dict
-    "stub": False
+    "stub": False,
+    # Opt-in: max Hamming distance (of the 256-bit image hash, 0..2) at which an
+    # upload counts as a repeat of a stored ingest and reuses its extraction
+    # instead of calling ParseExtract. null disables.
+    "dedupe_threshold": None,
+    # Opt-in: uploads arriving within window_ms are tiled into one composite
+    # image and extracted with a single ParseExtract request.
+    "batching": {"enabled": False, "max_size": 4, "window_ms": 400}
 }
 
 def load_config() -> Dict[str, Any]:
@@ -0,0 +1,131 @@
+import io
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, UnidentifiedImageError
+
+from . import storage
+
+# A 16x16 difference hash. Score screens of one app share their layout, so
+# an 8x8 hash barely sees the digits: different games land a bit or two
+# apart. At 256 bits the digit strokes show up, and only near-exact matches
+# (see MAX_THRESHOLD) are treated as the same screen.
+HASH_SIZE = 16
+HASH_BITS = HASH_SIZE * HASH_SIZE
+HASH_BYTES = HASH_BITS // 8
+
+
+def dhash(image_bytes: bytes, size: int=HASH_SIZE) -> Optional[int]:
+    """
+    size*size-bit difference hash: grayscale, shrink to (size+1) x size and
+    compare horizontally adjacent pixels. Stable across recompression and
+    rescaling. Returns None if the bytes are not a readable image.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.draft("L", (size * 8, size * 8))  # lets JPEG decode at reduced scale
+            small = img.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+    px = small.tobytes()
+    h = 0
+    for row in range(size):
+        base = row * (size + 1)
+        for col in range(size):
+            h = (h << 1) | (px[base + col] > px[base + col + 1])
+    return h
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def to_bytes(h: int) -> bytes:
+    """Storage form (SQLite BLOB)."""
+    return h.to_bytes(HASH_BYTES, "big")
+
+
+def from_bytes(b: bytes) -> int:
+    return int.from_bytes(b, "big")
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing over Hamming distance. The hash is split into
+    CHUNKS disjoint chunks, each with its own exact-match table. By the
+    pigeonhole principle, any hash within radius r < CHUNKS matches the query
+    exactly in at least one chunk, so a lookup is CHUNKS dict probes plus a
+    check of the few candidates found.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = HASH_BITS // CHUNKS
+    _MASK = (1 << CHUNK_BITS) - 1
+    MAX_RADIUS = CHUNKS - 1
+
+    def __init__(self) -> None:
+        self._hashes: List[int] = []
+        self._ids: List[int] = []
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in range(self.CHUNKS)]
+
+    @property
+    def size(self) -> int:
+        return len(self._ids)
+
+    def _chunks(self, h: int) -> List[int]:
+        return [(h >> (i * self.CHUNK_BITS)) & self._MASK for i in range(self.CHUNKS)]
+
+    def add(self, h: int, ingest_id: int) -> None:
+        pos = len(self._ids)
+        self._hashes.append(h)
+        self._ids.append(ingest_id)
+        for table, key in zip(self._tables, self._chunks(h)):
+            table.setdefault(key, []).append(pos)
+
+    def search(self, h: int, radius: int) -> List[Tuple[int, int]]:
+        """All (distance, ingest_id) within `radius` (at most MAX_RADIUS), nearest first."""
+        if not 0 <= radius <= self.MAX_RADIUS:
+            raise ValueError(f"radius must be between 0 and {self.MAX_RADIUS}")
+        seen = set()
+        out: List[Tuple[int, int]] = []
+        for table, key in zip(self._tables, self._chunks(h)):
+            for pos in table.get(key, ()):
+                if pos in seen:
+                    continue
+                seen.add(pos)
+                d = hamming(h, self._hashes[pos])
+                if d <= radius:
+                    out.append((d, self._ids[pos]))
+        out.sort()
+        return out
+
+
+# Largest accepted dedupe_threshold, in bits of HASH_BITS.
+MAX_THRESHOLD = 2
+
+
+# Process-wide index. Hashes are persisted in `ingests.dhash`, so the index is
+# rebuilt from the database on first use and topped up with rows written by
+# other workers before every lookup.
+_index = MultiIndexHash()
+_last_id = 0
+_lock = threading.Lock()
+
+
+def _refresh() -> None:
+    global _last_id
+    for ingest_id, h in storage.list_dhashes(after_id=_last_id):
+        _index.add(from_bytes(h), ingest_id)
+        _last_id = max(_last_id, ingest_id)
+
+
+def find_duplicate(h: int, threshold: int) -> Optional[Tuple[int, int]]:
+    """Nearest stored ingest within `threshold` bits as (ingest_id, distance), skipping deleted rows."""
+    with _lock:
+        _refresh()
+        candidates = _index.search(h, threshold)
+    for dist, ingest_id in candidates:
+        if storage.ingest_exists(ingest_id):
+            return ingest_id, dist
+    return None
+
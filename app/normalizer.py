@@ -1,4 +1,11 @@
-from typing import Any, Dict, List
+import re
+from itertools import chain
+from typing import Any, Collection, Dict, Iterator, List, Optional, Tuple
+
+# Bump whenever normalize_to_dartsmind output changes; stored per ingest so
+# `flask renormalize` only touches rows written by an older version.
+# Rows from before versioning count as 1.
+NORMALIZER_VERSION = 2
 
 def _coerce_bool(v: Any, default: bool=False) -> bool:
     if isinstance(v, bool):
@@ -12,7 +19,7 @@ def _limit_players(names: List[str]) -> List[str]:
     uniq = []
     for n in names:
         n = n.strip()
-        if not n: 
+        if not n:
             continue
         if n not in uniq:
             uniq.append(n)
@@ -22,71 +29,311 @@ def _limit_players(names: List[str]) -> List[str]:
         uniq = ["Player 1"]
     return uniq
 
+# ---- Parsing ----
+# Every input shape is reduced to a stream of entries:
+#   (player, leg, round, visit, after, darts)
+# where player is a name, an index or None, and leg/round may be None.
+Entry = Tuple[Any, Optional[int], Optional[int], int, Optional[int], List[int]]
+
+# One pass over the whole text. Recognizes "Leg 2" headers and visit lines like
+#   "R1: 60 (441)", "Alice R3: 100 [20, 60, 20] (301)", "Bob: 45 (456)"
+_TEXT_RE = re.compile(
+    r"""^[ \t]*(?:
+        leg[ \t]*\#?[ \t]*(\d+)[^\n]*
+      |
+        ([^\n:()\[\]]*):[ \t]*(\d+)([^\n(]*)\([^\n\d)]*(\d+)[^\n)]*\)
+    )""",
+    re.IGNORECASE | re.MULTILINE | re.VERBOSE,
+)
+# The part before the colon: "R3", "Alice R3" or just a player name ("Player 1", "Peter")
+_HEAD_RE = re.compile(r"(?:(.*?)\s+)?R(\d+)|(.*)", re.IGNORECASE)
+_INT_RE = re.compile(r"\d+")
+
+def _int(v: Any) -> Optional[int]:
+    if type(v) is int:
+        return v
+    if v is None or isinstance(v, bool):
+        return None
+    if isinstance(v, int):
+        return v
+    if isinstance(v, float):
+        return int(v)
+    if isinstance(v, str):
+        m = _INT_RE.search(v)
+        return int(m.group()) if m else None
+    return None
+
+def _darts(v: Any) -> List[int]:
+    if isinstance(v, list):
+        return [d for d in (_int(x) for x in v) if d is not None]
+    return []
+
+def _coerce_entry(t: Dict[str, Any]) -> Optional[Entry]:
+    """Entry from a dict with loosely typed fields ("60", 60.0, "R3", alternate keys)."""
+    visit = _int(t.get("visit") if t.get("visit") is not None else t.get("score"))
+    if visit is None:
+        return None
+    after = t.get("after")
+    player = t.get("player") or t.get("name")
+    return (
+        player if type(player) in (str, int) else None,
+        _int(t.get("leg")),
+        _int(t.get("round")),
+        visit,
+        _int(after if after is not None else t.get("remaining")),
+        _darts(t.get("darts")),
+    )
+
+def _entries_from_dicts(items: List[Any]) -> Iterator[Entry]:
+    for t in items:
+        if type(t) is not dict:
+            continue
+        visit = t.get("visit")
+        after = t.get("after")
+        rnd = t.get("round")
+        darts = t.get("darts")
+        if not (type(visit) is int and type(after) is int and (rnd is None or type(rnd) is int)
+                and type(darts) is list and (not darts or type(darts[0]) is int)):
+            entry = _coerce_entry(t)
+            if entry is not None:
+                yield entry
+            continue
+        if len(t) == 3 + (rnd is not None):
+            # Nothing but visit, after, darts (and round): no player or leg to look up
+            yield (None, None, rnd, visit, after, darts)
+            continue
+        player = t.get("player") or t.get("name")
+        leg = t.get("leg")
+        yield (
+            player if type(player) in (str, int) else None,
+            leg if leg is None or type(leg) is int else _int(leg),
+            rnd,
+            visit,
+            after,
+            darts,
+        )
+
+def _split_head(head: str, names: Collection[str]) -> Tuple[Optional[str], Optional[int]]:
+    """(player, round) of a visit line's head; a known player name is never split."""
+    head = head.strip()
+    if head in names:
+        return head, None
+    player, rnd, name = _HEAD_RE.fullmatch(head).groups()
+    if rnd is not None:
+        return player or None, int(rnd)
+    return name or None, None
+
+def _entries_from_text(text: str, names: Collection[str]=()) -> Iterator[Entry]:
+    leg: Optional[int] = None
+    head_cache: Dict[str, Tuple[Optional[str], Optional[int]]] = {}
+    for leg_no, head, visit, darts, after in _TEXT_RE.findall(text):
+        if leg_no:
+            leg = int(leg_no)
+            continue
+        # Heads repeat a lot ("R1".."R20", player names), so split each only once
+        split = head_cache.get(head)
+        if split is None:
+            split = head_cache[head] = _split_head(head, names)
+        yield (
+            split[0],
+            leg,
+            split[1],
+            int(visit),
+            int(after),
+            [int(d) for d in _INT_RE.findall(darts)] if darts.strip() else [],
+        )
+
+def _payload(raw: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The dict holding `rounds`, wherever the API put it."""
+    for key in ("data", "output", "result", "extracted_data"):
+        v = raw.get(key)
+        if isinstance(v, dict) and isinstance(v.get("rounds"), list):
+            return v
+    if isinstance(raw.get("rounds"), list):
+        return raw
+    return None
+
+def _iter_entries(raw: Dict[str, Any], names: Collection[str]=()) -> Iterator[Entry]:
+    # Returns the parser's own iterator rather than yielding from it, which
+    # would add a generator hop per entry.
+    frames = raw.get("frames")
+    if isinstance(frames, list):
+        # Stitched game session: frames in upload order
+        return chain.from_iterable(_iter_entries(f, names) for f in frames if isinstance(f, dict))
+
+    tokens = raw.get("tokens")
+    if isinstance(tokens, list):
+        return _entries_from_dicts(tokens)
+
+    payload = _payload(raw)
+    if payload is not None:
+        return _entries_from_dicts(payload["rounds"])
+
+    for key in ("text", "output", "data", "result", "extracted_data"):
+        v = raw.get(key)
+        if isinstance(v, str):
+            return _entries_from_text(v, names)
+    return iter(())
+
+def raw_player_names(raw: Dict[str, Any]) -> List[str]:
+    """Player names the extraction itself reported, if any."""
+    payload = _payload(raw)
+    if payload is not None and isinstance(payload.get("players"), list):
+        return [p for p in payload["players"] if isinstance(p, str)]
+    frames = raw.get("frames")
+    if isinstance(frames, list) and frames and isinstance(frames[0], dict):
+        return raw_player_names(frames[0])
+    return []
+
 def infer_visits_from_text(raw: dict) -> List[dict]:
+    """Flat list of visits in extraction order, ignoring player and leg."""
+    return [
+        {"round": rnd if rnd is not None else i + 1, "scoreOfVisit": visit, "scoreAfterVisit": after or 0, "dartsThrown": darts}
+        for i, (_, _, rnd, visit, after, darts) in enumerate(_iter_entries(raw))
+    ]
+
+# ---- Leg building ----
+# Scores a single visit can check out: 2..170 except these.
+_NO_CHECKOUT = frozenset({169, 168, 166, 165, 163, 162, 159})
+_CHECKOUTABLE = frozenset(range(2, 171)) - _NO_CHECKOUT
+
+class _Leg:
+    """Visits of one player in one leg plus running totals for the summary fields."""
+    __slots__ = ("number", "visits", "points", "darts", "best", "chances", "checkouts")
+
+    def __init__(self, number: int) -> None:
+        self.number = number
+        self.visits: List[dict] = []
+        self.points = 0
+        self.darts = 0
+        self.best = -1
+        self.chances = 0
+        self.checkouts = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "legNumber": self.number,
+            "visits": self.visits,
+            "average": round(3 * self.points / self.darts, 2) if self.darts else None,
+            "checkoutPercent": round(100 * self.checkouts / self.chances, 1) if self.chances else None,
+            "dartsThrown": self.darts or None,
+            "bestVisit": self.best if self.best >= 0 else None,
+        }
+
+def _build_legs(entries: Iterator[Entry], names: List[str]) -> List[List[_Leg]]:
     """
-    Very naive heuristic to demonstrate structure.
-    Replace with a proper mapper once your ParseExtract fields are known.
+    Assign each entry to a player and leg and update that leg's totals, in one pass.
+
+    Player: an explicit name/index wins. Otherwise the visit goes to the first
+    player, in turn order starting after the last thrower, whose remaining
+    score minus the visit equals the reported score after it; failing that,
+    simply to the next player in turn.
+    Leg: an explicit leg number wins; otherwise a checkout (after == 0) ends
+    the current leg for everyone.
     """
-    visits: List[dict] = []
-    tokens = raw.get("tokens")
-    if isinstance(tokens, list):
-        for t in tokens:
-            visits.append({
-                "round": int(t.get("round", len(visits)+1)),
-                "scoreOfVisit": int(t.get("visit", 0)),
-                "scoreAfterVisit": int(t.get("after", 0)),
-                "dartsThrown": t.get("darts", []),
-            })
-        return visits
-
-    # fallback: try 'text' lines "R#: 60 (441)"
-    text = raw.get("text", "")
-    if isinstance(text, str):
-        for line in text.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-            # crude parse
-            if ":" in line and "(" in line and ")" in line:
-                try:
-                    left, rest = line.split(":", 1)
-                    visit_str, after_paren = rest.split("(", 1)
-                    visit = int("".join(ch for ch in visit_str if ch.isdigit()))
-                    after = int("".join(ch for ch in after_paren if ch.isdigit()))
-                    visits.append({
-                        "round": len(visits)+1,
-                        "scoreOfVisit": visit,
-                        "scoreAfterVisit": after,
-                        "dartsThrown": [],
-                    })
-                except Exception:
-                    continue
-    return visits
+    n = len(names)
+    index = {name.lower(): i for i, name in enumerate(names)}
+    legs: List[List[_Leg]] = [[] for _ in names]
+    current: List[Optional[_Leg]] = [None] * n       # each player's leg in the current leg number
+    remaining: List[Optional[int]] = [None] * n      # each player's score left in the current leg
+    last_round = [0] * n                             # each player's last round in the current leg
+    order = [[(last + k) % n for k in range(1, n + 1)] for last in range(n)]
+    current_leg = 1
+    last = n - 1
+    checkoutable = _CHECKOUTABLE
+    multi = n > 1
+
+    for player, leg_no, rnd, visit, after, darts in entries:
+        if leg_no is not None and leg_no != current_leg:
+            current_leg = leg_no
+            current = [None] * n
+            remaining = [None] * n
+            last_round = [0] * n
+            last = n - 1
+
+        p: Optional[int] = None
+        if player is not None:
+            if type(player) is int:
+                p = player if 0 <= player < n else None
+            else:
+                p = index.get(player.lower())
+        if p is None:
+            p = order[last][0]
+            if multi and after is not None:
+                for cand in order[last]:
+                    rem = remaining[cand]
+                    if rem is not None and rem - visit == after:
+                        p = cand
+                        break
+
+        leg = current[p]
+        if leg is None:
+            leg = current[p] = _Leg(current_leg)
+            legs[p].append(leg)
+        before = remaining[p]
+        if before is None and after is not None:
+            before = after + visit
+        if rnd is None or rnd <= last_round[p]:
+            rnd = last_round[p] + 1
+        last_round[p] = rnd
+
+        leg.visits.append({
+            "round": rnd,
+            "scoreOfVisit": visit,
+            "scoreAfterVisit": after if after is not None else 0,
+            "dartsThrown": darts,
+        })
+        leg.points += visit
+        leg.darts += len(darts) or 3
+        if visit > leg.best:
+            leg.best = visit
+        if before in checkoutable:
+            leg.chances += 1
+            if after == 0:
+                leg.checkouts += 1
+        remaining[p] = after if after is not None else (before - visit if before is not None else None)
+        last = p
+
+        if after == 0 and leg_no is None:
+            current_leg += 1
+            current = [None] * n
+            remaining = [None] * n
+            last_round = [0] * n
+            last = n - 1
+    return legs
+
+def new_visits(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The visits present in `after` but not in `before` (matched by player and
+    leg number), as a normalized document. Used to feed only the delta of a
+    re-normalized game session to the visit store.
+    """
+    seen: Dict[Tuple[Any, Any], int] = {}
+    for p in before.get("players", []):
+        for leg in p.get("legs", []):
+            seen[(p.get("playerName"), leg.get("legNumber"))] = len(leg.get("visits", []))
+    players = []
+    for p in after.get("players", []):
+        legs = []
+        for leg in p.get("legs", []):
+            fresh = leg.get("visits", [])[seen.get((p.get("playerName"), leg.get("legNumber")), 0):]
+            if fresh:
+                legs.append({"legNumber": leg.get("legNumber"), "visits": fresh})
+        players.append({"playerName": p.get("playerName"), "bust": p.get("bust", False), "legs": legs})
+    return {"players": players, "meta": after.get("meta", {})}
 
 def normalize_to_dartsmind(raw: Dict[str, Any], player_names: List[str], bust: Any=False, meta: Dict[str, Any]|None=None) -> Dict[str, Any]:
-    names = _limit_players(player_names or [])
+    names = _limit_players(player_names or raw_player_names(raw))
     bust_flag = _coerce_bool(bust, False)
 
-    visits = infer_visits_from_text(raw)
-
-    # A very basic single-leg skeleton for all players.
-    leg = {
-        "legNumber": 1,
-        "visits": visits,
-        # Summary fields can be computed later; keep placeholders here.
-        "average": None,
-        "checkoutPercent": None,
-        "dartsThrown": sum(len(v.get("dartsThrown", [])) or 3 for v in visits) if visits else None,
-        "bestVisit": max((v.get("scoreOfVisit", 0) for v in visits), default=None),
-    }
-
+    legs = _build_legs(_iter_entries(raw, names), names)
     return {
         "players": [
             {
                 "playerName": n,
                 "bust": bust_flag,
-                "legs": [leg],
-            } for n in names
+                "legs": [leg.to_dict() for leg in player_legs] or [_Leg(1).to_dict()],
+            } for n, player_legs in zip(names, legs)
         ],
         "meta": meta or {}
     }
@@ -1,21 +1,57 @@
 import os
 import json
-import requests
+import threading
 from typing import Any, Dict, Optional
 from .config_store import load_config
 
 class ParseExtractError(RuntimeError):
     pass
 
+# Seconds one ParseExtract request may take.
+REQUEST_TIMEOUT = 60
+
 def _bool_env(name: str, default: bool=False) -> bool:
     v = os.getenv(name)
     if v is None:
         return default
     return v.lower() in ("1","true","yes","y","on")
 
-def call_parseextract(image_bytes: bytes, filename: str, mime: str="image/jpeg") -> Dict[str, Any]:
+# One pooled HTTP session per process (keep-alive to ParseExtract). `requests`
+# is imported on first use; the session is rebuilt after a fork because
+# pooled sockets must not be shared between worker processes.
+_http = None
+_http_pid = None
+_http_lock = threading.Lock()
+
+def _http_session():
+    global _http, _http_pid
+    with _http_lock:
+        if _http is None or _http_pid != os.getpid():
+            import requests
+            _http = requests.Session()
+            _http_pid = os.getpid()
+        return _http
+
+def reset_http_pool() -> None:
+    """Drop the pooled session (call in a freshly forked worker)."""
+    global _http, _http_pid
+    with _http_lock:
+        _http = None
+        _http_pid = None
+
+def resolve_prompt(cfg: Dict[str, Any]) -> str:
+    # Get extraction prompt with schema
+    return cfg.get("prompt") or os.getenv("PARSEXTRACT_PROMPT") or '''Extract dart game data with this JSON schema:
+{
+  "rounds": [{"round": number, "visit": number, "after": number, "darts": [number, number, number]}],
+  "players": ["player_name"],
+  "scores": [number]
+}'''
+
+def call_parseextract(image_bytes: bytes, filename: str, mime: str="image/jpeg", prompt: Optional[str]=None) -> Dict[str, Any]:
     """
     Calls the ParseExtract API using the new data-extract endpoint with clean output processing.
+    `prompt` overrides the configured extraction prompt.
     """
     cfg = load_config()
     if cfg.get("stub") or _bool_env("PARSEXTRACT_STUB", False):
@@ -43,13 +79,7 @@ def call_parseextract(image_bytes: bytes, filename: str, mime: str="image/jpeg")
 
     url = cfg.get("parsextract_url") or os.getenv("PARSEXTRACT_URL") or "https://api.parseextract.com/v1/data-extract"
     
-    # Get extraction prompt with schema
-    prompt = cfg.get("prompt") or os.getenv("PARSEXTRACT_PROMPT") or '''Extract dart game data with this JSON schema:
-{
-  "rounds": [{"round": number, "visit": number, "after": number, "darts": [number, number, number]}],
-  "players": ["player_name"],
-  "scores": [number]
-}'''
+    prompt = prompt or resolve_prompt(cfg)
 
     headers = {"Authorization": api_key}
     files = {"file": (filename, image_bytes, mime)}
@@ -61,8 +91,9 @@ def call_parseextract(image_bytes: bytes, filename: str, mime: str="image/jpeg")
         for k, v in extra_params.items():
             data[k] = v
 
+    import requests
     try:
-        resp = requests.post(url, headers=headers, files=files, data=data, timeout=60)
+        resp = _http_session().post(url, headers=headers, files=files, data=data, timeout=REQUEST_TIMEOUT)
         resp.raise_for_status()
         out = resp.json()
         
@@ -0,0 +1,175 @@
+import io
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+from . import normalizer, storage
+from .parseextract_client import call_parseextract
+
+# Previous frames are kept as small grayscale thumbnails; diffs run on those.
+FRAME_WIDTH = 256
+# Mean absolute per-pixel difference (0..255) above which a thumbnail row counts as changed.
+ROW_THRESHOLD = 6.0
+# Extra context around the changed band, in thumbnail rows.
+ROW_MARGIN = 4
+# If more than this share of the frame's rows changed, it's a new screen: extract it in full.
+MAX_PARTIAL = 0.5
+# A row of the previous frame with a pixel standard deviation below this is
+# empty background; content appearing there is a new row, not an edited one.
+BLANK_STD = 4.0
+
+
+def new_session() -> str:
+    session_id = uuid.uuid4().hex
+    storage.create_session(session_id)
+    return session_id
+
+
+def _decode(image_bytes: bytes) -> Optional[Image.Image]:
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        img.load()
+        return img
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+
+def _thumbnail(img: Image.Image) -> np.ndarray:
+    h = max(1, round(img.height * FRAME_WIDTH / img.width))
+    return np.asarray(img.convert("L").resize((FRAME_WIDTH, h), Image.Resampling.BILINEAR), dtype=np.int16)
+
+
+def changed_bands(prev: np.ndarray, cur: np.ndarray) -> Optional[List[Tuple[int, int, bool]]]:
+    """
+    Runs of rows of `cur` that differ from `prev`, as (top, bottom, new)
+    row ranges padded by ROW_MARGIN (touching runs are merged). `new` means
+    the rows were empty in `prev`: content appeared rather than changed, as
+    for a new visit row, while e.g. the remaining-score header only changes.
+    [] means nothing changed; None means the frames aren't comparable or
+    too much changed for a partial extraction.
+    """
+    if prev.shape != cur.shape:
+        return None
+    changed = np.abs(cur - prev).mean(axis=1) > ROW_THRESHOLD
+    if not changed.any():
+        return []
+    if changed.mean() > MAX_PARTIAL:
+        return None
+    blank = prev.std(axis=1) < BLANK_STD
+    height = cur.shape[0]
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], changed.view(np.int8), [0]))))
+    bands: List[Tuple[int, int, bool]] = []
+    for start, end in edges.reshape(-1, 2):
+        top = max(0, int(start) - ROW_MARGIN)
+        bottom = min(height, int(end) + ROW_MARGIN)
+        new = bool(blank[start:end].all())
+        if bands and top <= bands[-1][1]:
+            prev_top, _, prev_new = bands[-1]
+            bands[-1] = (prev_top, bottom, prev_new and new)
+        else:
+            bands.append((top, bottom, new))
+    return bands
+
+
+def _crop_rows(img: Image.Image, bands: List[Tuple[int, int]], thumb_height: int) -> bytes:
+    """The given thumbnail row ranges of `img` at full resolution, stacked top to bottom."""
+    scale = img.height / thumb_height
+    rgb = img.convert("RGB")
+    crops = [
+        rgb.crop((0, int(top * scale), img.width, min(img.height, int(round(bottom * scale)))))
+        for top, bottom in bands
+    ]
+    sheet = Image.new("RGB", (img.width, sum(c.height for c in crops)))
+    y = 0
+    for c in crops:
+        sheet.paste(c, (0, y))
+        y += c.height
+    out = io.BytesIO()
+    sheet.save(out, "PNG")
+    return out.getvalue()
+
+
+# Tries before giving up when other uploads to the same session keep landing first.
+STITCH_ATTEMPTS = 3
+
+
+class SessionConflict(RuntimeError):
+    """Other uploads to the session kept being stored while this frame was processed."""
+
+
+def stitch_upload(session_id: str, contents: bytes, filename: str, mime: str, players: List[str], bust: bool, meta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Process one frame of a live game session. Only the rows that appeared
+    since the session's previous frame (new visits) are sent to ParseExtract
+    and appended to the session's ingest; rows that merely changed, like the
+    remaining-score header, are not re-sent. A frame that looks like a new
+    screen, or changes without adding rows, is extracted in full and
+    replaces the session's frames. The first frame starts the ingest.
+
+    Frames of one session are stored one at a time: if another upload to the
+    session was stored meanwhile, this frame is diffed again against that one
+    (raises SessionConflict after STITCH_ATTEMPTS). Returns None for an
+    unknown session.
+    """
+    for _ in range(STITCH_ATTEMPTS):
+        session = storage.get_session(session_id)
+        if session is None:
+            return None
+        result = _stitch(session, contents, filename, mime, players, bust, meta)
+        if result is not None:
+            return result
+    raise SessionConflict(f"Session {session_id} is busy with other uploads; try again")
+
+
+def _stitch(session: Dict[str, Any], contents: bytes, filename: str, mime: str, players: List[str], bust: bool, meta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """One attempt of stitch_upload against `session` as read; None if another upload was stored first."""
+    img = _decode(contents)
+    thumb = _thumbnail(img) if img is not None else None
+    current = storage.get_ingest(session["ingest_id"]) if session["ingest_id"] else None
+
+    bands = None
+    if thumb is not None and current and session["frame"]:
+        shape = tuple(session["frame_meta"].get("shape") or ())
+        if len(shape) == 2:
+            prev = np.frombuffer(session["frame"], dtype=np.uint8).reshape(shape).astype(np.int16)
+            bands = changed_bands(prev, thumb)
+
+    if bands == []:
+        return {"id": current["id"], "mode": "unchanged", "sent_bytes": 0, "appended": 0, "normalized": current["normalized"]}
+
+    frame = thumb.astype(np.uint8).tobytes() if thumb is not None else None
+    frame_meta = {"shape": list(thumb.shape)} if thumb is not None else {}
+
+    new_bands = [(top, bottom) for top, bottom, new in bands or () if new]
+    if not new_bands:
+        raw = call_parseextract(contents, filename, mime=mime)
+        if current is None:
+            normalized = normalizer.normalize_to_dartsmind(raw, players, bust, meta=meta)
+            new_ingest = {"filename": filename, "player_names": players, "bust": bust}
+            ingest_id = storage.save_session_frame(session, None, {"frames": [raw]}, normalized, meta, frame, frame_meta, new_ingest)
+        else:
+            # The screen shows the whole game again: it supersedes the earlier frames.
+            normalized = normalizer.normalize_to_dartsmind(raw, players or current["player_names"], bust, meta=current["meta"])
+            ingest_id = storage.save_session_frame(session, current["id"], {"frames": [raw]}, normalized, current["meta"], frame, frame_meta)
+        if ingest_id is None:
+            return None
+        return {"id": ingest_id, "mode": "full", "sent_bytes": len(contents), "appended": None, "raw": raw, "normalized": normalized}
+
+    crop = _crop_rows(img, new_bands, thumb.shape[0])
+    raw = call_parseextract(crop, f"delta-{Path(filename).stem}.png", mime="image/png")
+    frames = current["raw"].get("frames") if isinstance(current["raw"].get("frames"), list) else [current["raw"]]
+    stitched = {"frames": frames + [raw]}
+    # Re-normalize the whole session so new visits are attributed with the
+    # remaining scores of every player in view. The new frame can also move
+    # earlier visits (attribution, leg splits), so the visit store takes the
+    # whole ingest again; `appended` counts only the added visits.
+    normalized = normalizer.normalize_to_dartsmind(stitched, players or current["player_names"], bust, meta=current["meta"])
+    if storage.save_session_frame(session, current["id"], stitched, normalized, current["meta"], frame, frame_meta) is None:
+        return None
+
+    addition = normalizer.new_visits(current["normalized"], normalized)
+    appended = sum(len(l["visits"]) for p in addition.get("players", []) for l in p.get("legs", []))
+    return {"id": current["id"], "mode": "partial", "sent_bytes": len(crop), "appended": appended, "raw": raw, "normalized": normalized}
@@ -1,17 +1,33 @@
+import html
 import json
+import logging
+import re
 import sqlite3
+import threading
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .normalizer import NORMALIZER_VERSION
 
 DB_PATH = Path(__file__).resolve().parent.parent / "data.db"
 
+logger = logging.getLogger(__name__)
+
 def _get_conn() -> sqlite3.Connection:
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
+# Bump whenever init_db changes the schema; init_db is a no-op for databases
+# already at this version (stored in PRAGMA user_version).
+SCHEMA_VERSION = 2
+
 def init_db() -> None:
     with _get_conn() as conn:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        # WAL lets worker processes read while another one writes
+        conn.execute("PRAGMA journal_mode=WAL")
         conn.execute("""
             CREATE TABLE IF NOT EXISTS ingests (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -24,23 +40,311 @@ def init_db() -> None:
                 normalized_json TEXT
             )
         """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                created_at TEXT DEFAULT (datetime('now')),
+                updated_at TEXT DEFAULT (datetime('now')),
+                ingest_id INTEGER,
+                frame BLOB,
+                frame_meta TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT DEFAULT (datetime('now')),
+                type TEXT,
+                data_json TEXT
+            )
+        """)
+        _migrate_columns(conn)
+        _init_search(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+
+# Columns added after the initial schema, applied to existing databases on startup.
+_ADDED_COLUMNS = {
+    "duplicate_of": "INTEGER",  # ingest whose extraction was reused
+    "normalizer_version": "INTEGER",  # NORMALIZER_VERSION that wrote normalized_json (NULL = 1)
+    "dhash": "BLOB",            # 256-bit difference hash of the upload (image_hash.to_bytes)
+}
+
+def _migrate_columns(conn: sqlite3.Connection) -> None:
+    have = {r["name"] for r in conn.execute("PRAGMA table_info(ingests)")}
+    for name, decl in _ADDED_COLUMNS.items():
+        if name not in have:
+            conn.execute(f"ALTER TABLE ingests ADD COLUMN {name} {decl}")
+
+# Full-text index over filename, player names, meta and the raw extraction.
+# External-content FTS5 table: the text lives only in `ingests`, triggers keep the index in sync.
+_FTS_COLUMNS = ("filename", "player_names", "meta_json", "raw_json")
+# bm25 column weights, same order as _FTS_COLUMNS
+_FTS_WEIGHTS = (5.0, 10.0, 3.0, 1.0)
+
+def _init_search(conn: sqlite3.Connection) -> None:
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='ingests_fts'").fetchone()
+    cols = ", ".join(_FTS_COLUMNS)
+    new_cols = ", ".join(f"new.{c}" for c in _FTS_COLUMNS)
+    old_cols = ", ".join(f"old.{c}" for c in _FTS_COLUMNS)
+    conn.executescript(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS ingests_fts USING fts5(
+            {cols},
+            content='ingests', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS ingests_fts_ai AFTER INSERT ON ingests BEGIN
+            INSERT INTO ingests_fts(rowid, {cols}) VALUES (new.id, {new_cols});
+        END;
+        CREATE TRIGGER IF NOT EXISTS ingests_fts_ad AFTER DELETE ON ingests BEGIN
+            INSERT INTO ingests_fts(ingests_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+        END;
+        DROP TRIGGER IF EXISTS ingests_fts_au;
+        CREATE TRIGGER ingests_fts_au AFTER UPDATE OF {cols} ON ingests BEGIN
+            INSERT INTO ingests_fts(ingests_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+            INSERT INTO ingests_fts(rowid, {cols}) VALUES (new.id, {new_cols});
+        END;
+    """)
+    if not exists:
+        # Index rows that were stored before the search table existed.
+        conn.execute("INSERT INTO ingests_fts(ingests_fts) VALUES ('rebuild')")
+
+def rebuild_search_index() -> int:
+    """Rebuild the FTS index from scratch and optimize it. Returns the number of indexed rows."""
+    with _get_conn() as conn:
+        conn.execute("INSERT INTO ingests_fts(ingests_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO ingests_fts(ingests_fts) VALUES ('optimize')")
+        conn.commit()
+        return conn.execute("SELECT count(*) FROM ingests").fetchone()[0]
+
+def _fts_query(q: str) -> str:
+    """
+    Turn free user input into a safe FTS5 query: every term is quoted
+    (so operators and punctuation can't break the syntax) and prefix-matched.
+    """
+    terms = [t.replace('"', '""') for t in q.split() if t.strip('"')]
+    return " ".join(f'"{t}"*' for t in terms)
+
+# Match delimiters for snippet(): control characters, swapped for <mark> tags
+# after the text is HTML-escaped. JSON columns escape them, so at worst a
+# filename containing one yields a stray <mark>.
+_HL_START, _HL_END = "\x02", "\x03"
+_JSON_ESCAPE_RE = re.compile(r"\\[nrt]")
+_JSON_PUNCT_RE = re.compile(r'[{}\[\]"\\,]+')
+
+def _render_snippet(text: str, from_json: bool) -> str:
+    """HTML-safe snippet: escaped text with <mark> around the matched terms."""
+    if from_json:
+        # meta_json/raw_json: keep the words, drop the JSON punctuation
+        text = _JSON_ESCAPE_RE.sub(" ", text)
+        text = _JSON_PUNCT_RE.sub(" ", text)
+        text = " ".join(text.replace(" :", ":").split())
+    return html.escape(text).replace(_HL_START, "<mark>").replace(_HL_END, "</mark>")
+
+def search_ingests(q: str, limit: int=20, cursor: Optional[str]=None) -> Dict[str, Any]:
+    """
+    Ranked search with highlighted snippets.
+    Keyset pagination on (rank, id): pass back `next_cursor` to get the next page.
+    The snippet comes from the filename or player names when they match, else
+    from the best-matching JSON column with its punctuation stripped. It is
+    HTML-escaped, with matches wrapped in <mark>; `snippet_field` names its column.
+    """
+    match = _fts_query(q)
+    if not match:
+        return {"items": [], "next_cursor": None}
+    limit = max(1, min(int(limit), 100))
+
+    where = ""
+    params: List[Any] = [match]
+    if cursor:
+        try:
+            c_rank, c_id = cursor.split(":", 1)
+            where = "WHERE rank > ? OR (rank = ? AND id > ?)"
+            params += [float(c_rank), float(c_rank), int(c_id)]
+        except ValueError:
+            raise ValueError("Invalid cursor")
+    params.append(limit + 1)
+
+    weights = ", ".join(str(w) for w in _FTS_WEIGHTS)
+    with _get_conn() as conn:
+        # Rank first, then build snippets only for the rows on this page.
+        page = conn.execute(f"""
+            SELECT id, rank FROM (
+                SELECT rowid AS id, bm25(ingests_fts, {weights}) AS rank
+                FROM ingests_fts WHERE ingests_fts MATCH ?
+            )
+            {where}
+            ORDER BY rank, id
+            LIMIT ?
+        """, params).fetchall()
+        ids = [r["id"] for r in page[:limit]]
+        details = {}
+        if ids:
+            marks = ",".join(f":id{k}" for k in range(len(ids)))
+            for r in conn.execute(f"""
+                SELECT i.id, i.created_at, i.filename, i.player_names, i.bust,
+                       snippet(ingests_fts, 0, :s, :e, '…', 12) AS s0,
+                       snippet(ingests_fts, 1, :s, :e, '…', 12) AS s1,
+                       snippet(ingests_fts, 2, :s, :e, '…', 12) AS s2,
+                       snippet(ingests_fts, 3, :s, :e, '…', 12) AS s3
+                FROM ingests_fts
+                JOIN ingests i ON i.id = ingests_fts.rowid
+                WHERE ingests_fts MATCH :q AND ingests_fts.rowid IN ({marks})
+            """, {"s": _HL_START, "e": _HL_END, "q": match, **{f"id{k}": v for k, v in enumerate(ids)}}).fetchall():
+                details[r["id"]] = r
+
+    items = []
+    for p in page[:limit]:
+        r = details.get(p["id"])
+        if r is None:
+            continue
+        # First column with a match, in order filename, players, meta, raw
+        col = next((k for k in range(len(_FTS_COLUMNS)) if _HL_START in (r[f"s{k}"] or "")), 0)
+        items.append({
+            "id": r["id"],
+            "created_at": r["created_at"],
+            "filename": r["filename"],
+            "player_names": json.loads(r["player_names"] or "[]"),
+            "bust": bool(r["bust"]),
+            "rank": p["rank"],
+            "snippet": _render_snippet(r[f"s{col}"] or "", from_json=col > 0),
+            "snippet_field": _FTS_COLUMNS[col],
+        })
+    next_cursor = None
+    if len(page) > limit:
+        last = page[limit - 1]
+        next_cursor = f"{last['rank']!r}:{last['id']}"
+    return {"items": items, "next_cursor": next_cursor}
+
+def _insert_ingest(conn: sqlite3.Connection, filename: str, player_names: List[str], bust: bool, meta: Dict[str, Any], raw: Dict[str, Any], normalized: Dict[str, Any], dhash: Optional[bytes]=None, duplicate_of: Optional[int]=None) -> int:
+    cur = conn.execute("""
+        INSERT INTO ingests (filename, player_names, bust, meta_json, raw_json, normalized_json, dhash, duplicate_of, normalizer_version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        filename,
+        json.dumps(player_names, ensure_ascii=False),
+        1 if bust else 0,
+        json.dumps(meta or {}, ensure_ascii=False),
+        json.dumps(raw, ensure_ascii=False),
+        json.dumps(normalized, ensure_ascii=False),
+        dhash,
+        duplicate_of,
+        NORMALIZER_VERSION,
+    ))
+    new_id = cur.lastrowid or 0
+    r = conn.execute("SELECT created_at FROM ingests WHERE id = ?", (new_id,)).fetchone()
+    _publish(conn, "ingest.created", {
+        "id": new_id,
+        "created_at": r["created_at"],
+        "filename": filename,
+        "player_names": player_names,
+        "bust": bool(bust),
+    })
+    return new_id
+
+def insert_ingest(filename: str, player_names: List[str], bust: bool, meta: Dict[str, Any], raw: Dict[str, Any], normalized: Dict[str, Any], dhash: Optional[bytes]=None, duplicate_of: Optional[int]=None) -> int:
+    with _get_conn() as conn:
+        new_id = _insert_ingest(conn, filename, player_names, bust, meta, raw, normalized, dhash, duplicate_of)
         conn.commit()
+    _notify()
+    _append_visits(new_id, normalized, meta)
+    return new_id
+
+def _append_visits(ingest_id: int, normalized: Dict[str, Any], meta: Dict[str, Any]) -> None:
+    from . import visit_store
+    try:
+        visit_store.append_ingest(ingest_id, normalized, meta)
+    except Exception:
+        # The ingest itself is stored; analytics catch up with `rebuild-visits`
+        logger.exception("Visit store append failed for ingest %s; run `flask --app main rebuild-visits`", ingest_id)
+
+def _replace_visits(ingest_id: int, normalized: Dict[str, Any], meta: Dict[str, Any]) -> None:
+    from . import visit_store
+    try:
+        visit_store.replace_ingests([(ingest_id, normalized, meta)])
+    except Exception:
+        logger.exception("Visit store update failed for ingest %s; run `flask --app main rebuild-visits`", ingest_id)
+
+def _update_ingest(conn: sqlite3.Connection, ingest_id: int, raw: Dict[str, Any], normalized: Dict[str, Any]) -> bool:
+    cur = conn.execute(
+        "UPDATE ingests SET raw_json = ?, normalized_json = ?, normalizer_version = ? WHERE id = ?",
+        (json.dumps(raw, ensure_ascii=False), json.dumps(normalized, ensure_ascii=False), NORMALIZER_VERSION, ingest_id),
+    )
+    updated = cur.rowcount > 0
+    if updated:
+        _publish(conn, "ingest.updated", {"id": ingest_id})
+    return updated
+
+def update_ingest(ingest_id: int, raw: Dict[str, Any], normalized: Dict[str, Any]) -> bool:
+    with _get_conn() as conn:
+        updated = _update_ingest(conn, ingest_id, raw, normalized)
+        conn.commit()
+    if updated:
+        _notify()
+    return updated
+
+def count_outdated(version: int=NORMALIZER_VERSION) -> int:
+    with _get_conn() as conn:
+        return conn.execute(
+            "SELECT count(*) FROM ingests WHERE COALESCE(normalizer_version, 1) < ?", (version,)
+        ).fetchone()[0]
+
+def iter_outdated(version: int=NORMALIZER_VERSION, chunk_size: int=500) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Stream ingests normalized by an older version, in id order, `chunk_size`
+    rows at a time (keyset on id, so memory stays bounded).
+    """
+    last_id = 0
+    while True:
+        with _get_conn() as conn:
+            rows = conn.execute("""
+                SELECT id, player_names, bust, meta_json, raw_json FROM ingests
+                WHERE id > ? AND COALESCE(normalizer_version, 1) < ?
+                ORDER BY id LIMIT ?
+            """, (last_id, version, chunk_size)).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        yield [{
+            "id": r["id"],
+            "player_names": r["player_names"],
+            "bust": r["bust"],
+            "meta_json": r["meta_json"],
+            "raw_json": r["raw_json"],
+        } for r in rows]
 
-def insert_ingest(filename: str, player_names: List[str], bust: bool, meta: Dict[str, Any], raw: Dict[str, Any], normalized: Dict[str, Any]) -> int:
-    with _get_conn() as conn:
-        cur = conn.execute("""
-            INSERT INTO ingests (filename, player_names, bust, meta_json, raw_json, normalized_json)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            filename,
-            json.dumps(player_names, ensure_ascii=False),
-            1 if bust else 0,
-            json.dumps(meta or {}, ensure_ascii=False),
-            json.dumps(raw, ensure_ascii=False),
-            json.dumps(normalized, ensure_ascii=False),
-        ))
+def iter_normalized(chunk_size: int=500) -> Iterator[List[Tuple[int, Dict[str, Any], Dict[str, Any]]]]:
+    """Stream (id, normalized, meta) of every ingest in id order, `chunk_size` rows at a time."""
+    last_id = 0
+    while True:
+        with _get_conn() as conn:
+            rows = conn.execute(
+                "SELECT id, normalized_json, meta_json FROM ingests WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, chunk_size),
+            ).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        yield [(r["id"], json.loads(r["normalized_json"] or "{}"), json.loads(r["meta_json"] or "{}")) for r in rows]
+
+def save_renormalized(results: List[Tuple[int, str]], version: int=NORMALIZER_VERSION) -> List[int]:
+    """
+    Write (id, normalized_json) pairs back in one transaction. Rows rewritten
+    at `version` or newer since they were read (e.g. by a session upload) are
+    left alone. Returns the ids actually updated.
+    """
+    updated = []
+    with _get_conn() as conn:
+        for ingest_id, normalized_json in results:
+            cur = conn.execute(
+                "UPDATE ingests SET normalized_json = ?, normalizer_version = ? "
+                "WHERE id = ? AND COALESCE(normalizer_version, 1) < ?",
+                (normalized_json, version, ingest_id, version),
+            )
+            if cur.rowcount > 0:
+                updated.append(ingest_id)
         conn.commit()
-        return cur.lastrowid or 0
+    return updated
 
 def list_ingests(limit: int=50) -> List[Dict[str, Any]]:
     with _get_conn() as conn:
@@ -70,10 +374,152 @@ def get_ingest(ingest_id: int) -> Optional[Dict[str, Any]]:
             "meta": json.loads(r["meta_json"] or "{}"),
             "raw": json.loads(r["raw_json"] or "{}"),
             "normalized": json.loads(r["normalized_json"] or "{}"),
+            "duplicate_of": r["duplicate_of"],
         }
 
+def ingest_exists(ingest_id: int) -> bool:
+    with _get_conn() as conn:
+        return conn.execute("SELECT 1 FROM ingests WHERE id = ?", (ingest_id,)).fetchone() is not None
+
+def list_dhashes(after_id: int=0) -> List[Tuple[int, bytes]]:
+    """(id, dhash) of all hashed ingests with id > after_id, in id order."""
+    with _get_conn() as conn:
+        rows = conn.execute(
+            "SELECT id, dhash FROM ingests WHERE id > ? AND dhash IS NOT NULL ORDER BY id", (after_id,)
+        ).fetchall()
+        return [(r["id"], r["dhash"]) for r in rows]
+
 def delete_ingest(ingest_id: int) -> bool:
     with _get_conn() as conn:
         cur = conn.execute("DELETE FROM ingests WHERE id = ?", (ingest_id,))
+        deleted = cur.rowcount > 0
+        if deleted:
+            _publish(conn, "ingest.deleted", {"id": ingest_id})
+        conn.commit()
+    if deleted:
+        _notify()
+        from . import visit_store
+        try:
+            visit_store.mark_deleted(ingest_id)
+        except Exception:
+            logger.exception("Visit store delete failed for ingest %s; run `flask --app main rebuild-visits`", ingest_id)
+    return deleted
+
+# ---- Game sessions (incremental stitching) ----
+def create_session(session_id: str) -> None:
+    with _get_conn() as conn:
+        conn.execute("INSERT OR IGNORE INTO sessions (id) VALUES (?)", (session_id,))
+        conn.commit()
+
+def get_session(session_id: str) -> Optional[Dict[str, Any]]:
+    with _get_conn() as conn:
+        r = conn.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if not r:
+            return None
+        return {
+            "id": r["id"],
+            "created_at": r["created_at"],
+            "updated_at": r["updated_at"],
+            "ingest_id": r["ingest_id"],
+            "frame": r["frame"],
+            "frame_meta": json.loads(r["frame_meta"] or "{}"),
+        }
+
+def save_session_frame(session: Dict[str, Any], ingest_id: Optional[int], raw: Dict[str, Any], normalized: Dict[str, Any], meta: Dict[str, Any], frame: Optional[bytes], frame_meta: Dict[str, Any], new_ingest: Optional[Dict[str, Any]]=None) -> Optional[int]:
+    """
+    Store a session's stitched extraction and latest frame in one
+    transaction, unless another upload to the session was stored since
+    `session` was read (its updated_at no longer matches). Updates
+    `ingest_id`, or with None inserts the session's ingest from
+    `new_ingest` (filename, player_names, bust). A `frame` of None keeps
+    the previous one. Returns the ingest id, or None on a conflict.
+    """
+    with _get_conn() as conn:
+        # Millisecond timestamps, so back-to-back frames never look unchanged
+        cur = conn.execute(
+            "UPDATE sessions SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = ? AND updated_at IS ?",
+            (session["id"], session["updated_at"]),
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            return None
+        if ingest_id is None:
+            ingest_id = _insert_ingest(conn, new_ingest["filename"], new_ingest["player_names"], new_ingest["bust"], meta, raw, normalized)
+            created = True
+        else:
+            _update_ingest(conn, ingest_id, raw, normalized)
+            created = False
+        if frame is not None:
+            conn.execute(
+                "UPDATE sessions SET ingest_id = ?, frame = ?, frame_meta = ? WHERE id = ?",
+                (ingest_id, frame, json.dumps(frame_meta), session["id"]),
+            )
+        else:
+            conn.execute("UPDATE sessions SET ingest_id = ? WHERE id = ?", (ingest_id, session["id"]))
+        conn.commit()
+    _notify()
+    if created:
+        _append_visits(ingest_id, normalized, meta)
+    else:
+        _replace_visits(ingest_id, normalized, meta)
+    return ingest_id
+
+def delete_session(session_id: str) -> bool:
+    with _get_conn() as conn:
+        cur = conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
         conn.commit()
         return cur.rowcount > 0
+
+# ---- Event log (server-sent events) ----
+# Events live in SQLite so every worker process can stream them and clients
+# can resume from Last-Event-ID. Only the most recent EVENT_RETENTION are kept.
+EVENT_RETENTION = 10000
+
+_events_changed = threading.Condition()
+
+def _publish(conn: sqlite3.Connection, event_type: str, data: Dict[str, Any]) -> int:
+    cur = conn.execute(
+        "INSERT INTO events (type, data_json) VALUES (?, ?)",
+        (event_type, json.dumps(data, ensure_ascii=False)),
+    )
+    event_id = cur.lastrowid or 0
+    if event_id % 500 == 0:
+        conn.execute("DELETE FROM events WHERE id <= ?", (event_id - EVENT_RETENTION,))
+    return event_id
+
+def _notify() -> None:
+    with _events_changed:
+        _events_changed.notify_all()
+
+def wake_event_streams() -> None:
+    """Wake every waiting event stream in this process (e.g. to let them close)."""
+    _notify()
+
+def publish_event(event_type: str, data: Dict[str, Any]) -> int:
+    with _get_conn() as conn:
+        event_id = _publish(conn, event_type, data)
+        conn.commit()
+    _notify()
+    return event_id
+
+def wait_for_events(timeout: float) -> None:
+    """Block until this process publishes an event or `timeout` passes (other workers are picked up by polling)."""
+    with _events_changed:
+        _events_changed.wait(timeout)
+
+def latest_event_id() -> int:
+    with _get_conn() as conn:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+def event_id_range() -> Tuple[int, int]:
+    """(oldest, latest) retained event id; (0, 0) while there are none."""
+    with _get_conn() as conn:
+        r = conn.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM events").fetchone()
+        return r[0], r[1]
+
+def list_events(after_id: int, limit: int=100) -> List[Dict[str, Any]]:
+    with _get_conn() as conn:
+        rows = conn.execute(
+            "SELECT id, type, data_json FROM events WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+        ).fetchall()
+        return [{"id": r["id"], "type": r["type"], "data": json.loads(r["data_json"] or "{}")} for r in rows]
@@ -0,0 +1,500 @@
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+STORE_DIR = Path(__file__).resolve().parent.parent / "visits"
+
+# Append-only column files, one fixed-width value per visit.
+COLUMNS = {
+    "ingest_id": np.int64,
+    "player_id": np.int32,
+    "day": np.int32,         # days since 1970-01-01
+    "leg": np.int16,
+    "round": np.int16,
+    "score": np.int16,       # scoreOfVisit, clamped to 0..180
+    "after": np.int16,       # scoreAfterVisit
+    "darts": np.int8,        # darts thrown in the visit, 1..3
+}
+
+# Zone map granularity: min/max of day, player_id and ingest_id per chunk of rows.
+CHUNK_ROWS = 65536
+
+_EPOCH = date(1970, 1, 1)
+_lock = threading.Lock()
+
+
+@contextmanager
+def _locked():
+    """Serialize writers across threads and across worker processes."""
+    with _lock:
+        STORE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(STORE_DIR / ".lock", "w") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+def _col_path(name: str) -> Path:
+    return STORE_DIR / f"{name}.bin"
+
+
+def _players_path() -> Path:
+    return STORE_DIR / "players.json"
+
+
+def _deleted_path() -> Path:
+    return STORE_DIR / "tombstones.bin"
+
+
+def _zones_path() -> Path:
+    return STORE_DIR / "zonemap.bin"
+
+
+def _state_path() -> Path:
+    return STORE_DIR / "state.json"
+
+
+def _read_json(path: Path, default: Any) -> Any:
+    if path.exists():
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return default
+    return default
+
+
+def _write_json(path: Path, data: Any) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+# state.json holds the committed row count, written only after every column
+# (and the zone map) holds those rows. Readers never look past it, so an
+# append in progress or cut short by a crash stays invisible; the next append
+# truncates the columns back to it first.
+def _state() -> Optional[Dict[str, Any]]:
+    return _read_json(_state_path(), None)
+
+
+def _row_count() -> int:
+    state = _state()
+    if state is not None:
+        return int(state.get("rows", 0))
+    # Store written before state.json existed: rows every column holds
+    return min(
+        _col_path(name).stat().st_size // np.dtype(dtype).itemsize if _col_path(name).exists() else 0
+        for name, dtype in COLUMNS.items()
+    )
+
+
+def _column(name: str, rows: int) -> np.ndarray:
+    """Read-only memory map over the first `rows` values of a column."""
+    if rows == 0:
+        return np.empty(0, dtype=COLUMNS[name])
+    return np.memmap(_col_path(name), dtype=COLUMNS[name], mode="r", shape=(rows,))
+
+
+# Zone map columns
+_DAY_MIN, _DAY_MAX, _PLAYER_MIN, _PLAYER_MAX, _INGEST_MIN, _INGEST_MAX = range(6)
+
+
+def _read_zones() -> np.ndarray:
+    p = _zones_path()
+    if not p.exists():
+        return np.empty((0, 6), dtype=np.int64)
+    return np.fromfile(p, dtype=np.int64).reshape(-1, 6)
+
+
+def _zones(rows: int) -> Optional[np.ndarray]:
+    """Zone map as (chunks, 6) int64, see _DAY_MIN etc.; None if missing (no pruning)."""
+    chunks = -(-rows // CHUNK_ROWS)
+    z = _read_zones()
+    return z[:chunks] if len(z) >= chunks else None
+
+
+def _update_zones(first_row: int, rows: int) -> None:
+    """Recompute zone map entries for the chunks touched by rows >= first_row."""
+    z = _read_zones()
+    start_chunk = min(first_row // CHUNK_ROWS, len(z))
+    chunks = -(-rows // CHUNK_ROWS)
+    z = np.resize(z, (chunks, 6)) if len(z) < chunks else z[:chunks].copy()
+    cols = [_column(name, rows) for name in ("day", "player_id", "ingest_id")]
+    for c in range(start_chunk, chunks):
+        lo, hi = c * CHUNK_ROWS, min((c + 1) * CHUNK_ROWS, rows)
+        z[c] = [f(col[lo:hi]) for col in cols for f in (np.min, np.max)]
+    tmp = _zones_path().with_suffix(".tmp")
+    z.tofile(tmp)
+    os.replace(tmp, _zones_path())
+
+
+def _day_number(value: Any) -> int:
+    if isinstance(value, str):
+        try:
+            return (date.fromisoformat(value[:10]) - _EPOCH).days
+        except ValueError:
+            pass
+    return (date.today() - _EPOCH).days
+
+
+def _filter_day(value: str) -> int:
+    """Day number of a from/to filter; unlike match dates, no fallback to today."""
+    try:
+        return (date.fromisoformat(value[:10]) - _EPOCH).days
+    except ValueError:
+        raise ValueError(f"invalid date {value!r}, expected YYYY-MM-DD")
+
+
+def _day_to_iso(day: int) -> str:
+    return date.fromordinal(_EPOCH.toordinal() + int(day)).isoformat()
+
+
+def player_ids() -> Dict[str, int]:
+    return _read_json(_players_path(), {})
+
+
+def _collect_rows(cols: Dict[str, List[int]], players: Dict[str, int], ingest_id: int, normalized: Dict[str, Any], meta: Optional[Dict[str, Any]]) -> None:
+    meta = meta or normalized.get("meta") or {}
+    day = _day_number(meta.get("matchDate"))
+    for player in normalized.get("players", []):
+        name = player.get("playerName") or ""
+        if name not in players:
+            players[name] = len(players)
+        pid = players[name]
+        for leg in player.get("legs", []):
+            leg_no = int(leg.get("legNumber") or 1)
+            for v in leg.get("visits", []):
+                cols["ingest_id"].append(ingest_id)
+                cols["player_id"].append(pid)
+                cols["day"].append(day)
+                cols["leg"].append(leg_no)
+                cols["round"].append(int(v.get("round") or 0))
+                cols["score"].append(min(max(int(v.get("scoreOfVisit") or 0), 0), 180))
+                cols["after"].append(int(v.get("scoreAfterVisit") or 0))
+                cols["darts"].append(min(len(v.get("dartsThrown") or []), 3) or 3)
+
+
+def _append(items: List[Tuple[int, Dict[str, Any], Optional[Dict[str, Any]]]]) -> int:
+    """Append (ingest_id, normalized, meta) items; caller holds the lock."""
+    players = player_ids()
+    cols: Dict[str, List[int]] = {name: [] for name in COLUMNS}
+    for ingest_id, normalized, meta in items:
+        _collect_rows(cols, players, ingest_id, normalized, meta)
+
+    n = len(cols["ingest_id"])
+    if n == 0:
+        return 0
+
+    state = _state() or {}
+    first_row = _row_count()
+    _write_json(_players_path(), players)
+    for name, dtype in COLUMNS.items():
+        with open(_col_path(name), "ab") as f:
+            # Drop whatever an interrupted append left past the committed rows
+            f.truncate(first_row * np.dtype(dtype).itemsize)
+            f.write(np.asarray(cols[name], dtype=dtype).tobytes())
+    _update_zones(first_row, first_row + n)
+    _write_json(_state_path(), dict(state, rows=first_row + n))
+    return n
+
+
+def append_ingest(ingest_id: int, normalized: Dict[str, Any], meta: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Append all visits of a normalized DartsMind document to the column files.
+    Returns the number of visits written.
+    """
+    with _locked():
+        if ingest_id <= (_state() or {}).get("rebuilt_through", 0):
+            # A rebuild that ran while this append waited for the lock already has it
+            return 0
+        return _append([(ingest_id, normalized, meta)])
+
+
+def rebuild(batches: Iterable[List[Tuple[int, Dict[str, Any], Optional[Dict[str, Any]]]]]) -> int:
+    """
+    Recreate the store from (ingest_id, normalized, meta) batches in id order,
+    e.g. storage.iter_normalized(). Appends and deletes wait for the lock
+    meanwhile; queries see the store fill up. Returns the number of visits written.
+    """
+    with _locked():
+        _write_json(_state_path(), {"rows": 0})
+        for p in [_players_path(), _deleted_path(), _zones_path(), STORE_DIR / "zones.bin"] + [_col_path(name) for name in COLUMNS]:
+            p.unlink(missing_ok=True)
+        written = 0
+        through = 0
+        for items in batches:
+            written += _append(items)
+            through = max([through] + [i for i, _, _ in items])
+        _write_json(_state_path(), dict(_state() or {}, rebuilt_through=through))
+        return written
+
+
+# Tombstones map ingest_id -> row cutoff: rows of that ingest below the cutoff
+# are masked at query time. Deletes mask every row; replacing an ingest masks
+# only the rows written before the replacement. Stored as appended int64
+# (ingest_id, cutoff) pairs; the last pair for an id wins.
+_ALL_ROWS = 1 << 62
+
+
+def _read_tombstones() -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted unique ingest ids and their effective cutoffs."""
+    p = _deleted_path()
+    if not p.exists():
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    flat = np.fromfile(p, dtype=np.int64)
+    pairs = flat[:len(flat) // 2 * 2].reshape(-1, 2)
+    ids, first_in_reversed = np.unique(pairs[::-1, 0], return_index=True)
+    return ids, pairs[::-1, 1][first_in_reversed]
+
+
+def _append_tombstones(pairs: List[Tuple[int, int]]) -> None:
+    with open(_deleted_path(), "ab") as f:
+        # Drop half a pair left by an interrupted write
+        f.truncate(f.tell() // 16 * 16)
+        f.write(np.asarray(pairs, dtype=np.int64).reshape(-1, 2).tobytes())
+
+
+def mark_deleted(ingest_id: int) -> None:
+    """Column files are append-only; deleted ingests are masked at query time."""
+    with _locked():
+        _append_tombstones([(int(ingest_id), _ALL_ROWS)])
+
+
+def replace_ingests(items: List[Tuple[int, Dict[str, Any], Optional[Dict[str, Any]]]]) -> int:
+    """
+    Supersede the stored visits of each (ingest_id, normalized, meta) item
+    with freshly normalized ones. Returns the number of visits written.
+    """
+    with _locked():
+        cutoff = _row_count()
+        ids, cutoffs = _read_tombstones()
+        deleted = set(ids[cutoffs == _ALL_ROWS].tolist())
+        _append_tombstones([(i, cutoff) for i, _, _ in items if i not in deleted])
+        return _append(items)
+
+
+def _dead_rows(ingest: np.ndarray, lo: int, tomb: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """Boolean mask over ingest[...] (starting at row `lo`) of rows hidden by tombstones."""
+    ids, cutoffs = tomb
+    hi = lo + len(ingest)
+    if len(ids) <= 4:
+        # Usually a chunk holds only one or two tombstoned ingests
+        dead = np.zeros(len(ingest), dtype=bool)
+        for ingest_id, cutoff in zip(ids.tolist(), cutoffs.tolist()):
+            hit = ingest == ingest_id
+            if cutoff < hi:
+                hit &= np.arange(lo, hi) < cutoff
+            dead |= hit
+        return dead
+    pos = np.minimum(np.searchsorted(ids, ingest), len(ids) - 1)
+    hit = ids[pos] == ingest
+    return hit & (np.arange(lo, hi) < cutoffs[pos])
+
+
+def _tombstoned_chunks(zones: Optional[np.ndarray], tomb: Tuple[np.ndarray, np.ndarray], chunks: int) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Chunks holding rows that a tombstone may hide, from the zone map's
+    ingest_id range, each with the tombstones that fall in that range.
+    """
+    ids, cutoffs = tomb
+    if len(ids) == 0:
+        return {}
+    if zones is None:
+        return {c: tomb for c in range(chunks)}
+    first = np.searchsorted(ids, zones[:, _INGEST_MIN])
+    last = np.searchsorted(ids, zones[:, _INGEST_MAX], side="right")
+    hits = {}
+    for c in np.flatnonzero(last > first).tolist():
+        sl = slice(first[c], last[c])
+        if (cutoffs[sl] > c * CHUNK_ROWS).any():
+            hits[c] = (ids[sl], cutoffs[sl])
+    return hits
+
+
+def _select(player: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Resolve filters to row ranges using the zone map. Chunks the zone map
+    proves fully matching are taken whole (adjacent ones merged into one
+    span); only chunks straddling a filter bound or holding tombstoned
+    ingests are masked, down to the indices of their matching rows. Returns None if a named player is unknown.
+    Raises ValueError for an unparseable date filter.
+    """
+    rows = _row_count()
+    pid = None
+    if player is not None:
+        pid = player_ids().get(player)
+        if pid is None:
+            return None
+    d_lo = _filter_day(date_from) if date_from else None
+    d_hi = _filter_day(date_to) if date_to else None
+
+    chunks = -(-rows // CHUNK_ROWS)
+    zones = _zones(rows)
+    tombstoned = _tombstoned_chunks(zones, _read_tombstones(), chunks)
+    keep = np.ones(chunks, dtype=bool)
+    if zones is not None:
+        if pid is not None:
+            keep &= (zones[:, _PLAYER_MIN] <= pid) & (zones[:, _PLAYER_MAX] >= pid)
+        if d_lo is not None:
+            keep &= zones[:, _DAY_MAX] >= d_lo
+        if d_hi is not None:
+            keep &= zones[:, _DAY_MIN] <= d_hi
+
+    pids = _column("player_id", rows)
+    days = _column("day", rows)
+    ingest = _column("ingest_id", rows)
+    # (lo, hi, row indices or None for all of lo:hi), in row order
+    parts: List[Tuple[int, int, Optional[np.ndarray]]] = []
+    for c in np.flatnonzero(keep).tolist():
+        lo, hi = c * CHUNK_ROWS, min((c + 1) * CHUNK_ROWS, rows)
+        z = zones[c] if zones is not None else None
+        m = None
+        if pid is not None and (z is None or z[_PLAYER_MIN] != z[_PLAYER_MAX]):
+            m = pids[lo:hi] == pid
+        if d_lo is not None and (z is None or z[_DAY_MIN] < d_lo):
+            m = days[lo:hi] >= d_lo if m is None else m & (days[lo:hi] >= d_lo)
+        if d_hi is not None and (z is None or z[_DAY_MAX] > d_hi):
+            m = days[lo:hi] <= d_hi if m is None else m & (days[lo:hi] <= d_hi)
+        if c in tombstoned:
+            live = ~_dead_rows(ingest[lo:hi], lo, tombstoned[c])
+            m = live if m is None else m & live
+        if m is not None:
+            parts.append((lo, hi, np.flatnonzero(m) + lo))
+        elif parts and parts[-1][2] is None and parts[-1][1] == lo:
+            parts[-1] = (parts[-1][0], hi, None)
+        else:
+            parts.append((lo, hi, None))
+    return {"rows": rows, "parts": parts}
+
+
+def _gather(name: str, sel: Dict[str, Any]) -> np.ndarray:
+    col = _column(name, sel["rows"])
+    parts = sel["parts"]
+    if len(parts) == 1 and parts[0][2] is None and parts[0][1] - parts[0][0] == sel["rows"]:
+        return col
+    if not parts:
+        return col[:0]
+    return np.concatenate([col[lo:hi] if idx is None else col[idx] for lo, hi, idx in parts])
+
+
+def _pieces(sel: Dict[str, Any], *names: str) -> Iterator[List[np.ndarray]]:
+    """
+    The selected values of `names`, piece by piece, for aggregates that don't
+    depend on row order: each unmasked span as is (no copy), then the rows of
+    all masked chunks at once.
+    """
+    cols = [_column(name, sel["rows"]) for name in names]
+    masked = []
+    for lo, hi, idx in sel["parts"]:
+        if idx is None:
+            yield [col[lo:hi] for col in cols]
+        else:
+            masked.append(idx)
+    if masked:
+        idx = np.concatenate(masked)
+        yield [col[idx] for col in cols]
+
+
+def _size(sel: Optional[Dict[str, Any]]) -> int:
+    if sel is None:
+        return 0
+    return sum(hi - lo if idx is None else len(idx) for lo, hi, idx in sel["parts"])
+
+
+def rolling_average(player: str, window: int = 30, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Rolling 3-dart average over the last `window` visits of a player, in
+    match-date order (insertion order within a day).
+    """
+    sel = _select(player, date_from, date_to)
+    n = _size(sel)
+    if n == 0:
+        return {"player": player, "window": window, "points": []}
+    days = _gather("day", sel)
+    # Ingests can arrive out of date order (backfills, late uploads); rows are
+    # selected in insertion order, so a stable sort by day keeps that within a day.
+    order = np.argsort(days, kind="stable")
+    days = days[order]
+    score = _gather("score", sel).astype(np.int64)[order]
+    darts = _gather("darts", sel).astype(np.int64)[order]
+
+    window = max(1, int(window))
+    cs = np.concatenate(([0], np.cumsum(score)))
+    cd = np.concatenate(([0], np.cumsum(darts)))
+    hi = np.arange(1, n + 1)
+    lo = np.maximum(hi - window, 0)
+    avg = 3.0 * (cs[hi] - cs[lo]) / np.maximum(cd[hi] - cd[lo], 1)
+
+    # One point per day (the value at the last visit of that day) keeps responses small.
+    last_of_day = np.flatnonzero(np.append(days[1:] != days[:-1], True))
+    return {
+        "player": player,
+        "window": window,
+        "points": [
+            {"date": _day_to_iso(days[i]), "visits": int(i + 1), "average": round(float(avg[i]), 2)}
+            for i in last_of_day
+        ],
+    }
+
+
+def score_histogram(player: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
+    """Counts of scoreOfVisit values 0..180."""
+    sel = _select(player, date_from, date_to)
+    counts = np.zeros(181, dtype=np.int64)
+    if _size(sel):
+        for score, in _pieces(sel, "score"):
+            counts += np.bincount(score, minlength=181)
+    return {"player": player, "total": int(counts.sum()), "counts": counts.tolist()}
+
+
+def leaderboard(n: int = 10, min_visits: int = 1, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Top-N players by 3-dart average, with visit count, best visit and 180s."""
+    sel = _select(None, date_from, date_to)
+    if _size(sel) == 0:
+        return []
+    # A single bincount over (player, darts, score) yields every aggregate below.
+    # The key is built with one pass per column and no int32 round trip:
+    # darts * 181 + score fits int16 (max 723); bincount wants intp.
+    # Player ids are assigned before their rows are written, so all are < size.
+    size = len(player_ids())
+    cube = np.zeros(size * 4 * 181, dtype=np.int64)
+    for pid, score, darts in _pieces(sel, "player_id", "score", "darts"):
+        ds = np.multiply(darts, 181, dtype=np.int16)
+        ds += score
+        key = np.multiply(pid, 4 * 181, dtype=np.intp)
+        key += ds
+        cube += np.bincount(key, minlength=len(cube))
+    cube = cube.reshape(size, 4, 181)
+    per_score = cube.sum(axis=1)
+    visits = per_score.sum(axis=1)
+    points = per_score @ np.arange(181)
+    thrown = cube.sum(axis=2) @ np.arange(4)
+    maxes = per_score[:, 180]
+    best = 180 - np.argmax(per_score[:, ::-1] > 0, axis=1)
+
+    avg = np.where(thrown > 0, 3.0 * points / np.maximum(thrown, 1), 0.0)
+    eligible = np.flatnonzero(visits >= max(1, int(min_visits)))
+    n = max(0, int(n))
+    top = eligible[np.argsort(-avg[eligible], kind="stable")[:n]]
+
+    names = {v: k for k, v in player_ids().items()}
+    return [
+        {
+            "playerName": names.get(int(p), str(int(p))),
+            "average": round(float(avg[p]), 2),
+            "visits": int(visits[p]),
+            "dartsThrown": int(thrown[p]),
+            "bestVisit": int(best[p]),
+            "count180": int(maxes[p]),
+        }
+        for p in top
+    ]
@@ -1,34 +1,50 @@
 import json
 import os
+import time
 import logging
+import threading
 from typing import List, Optional, Any, Dict
 from pathlib import Path
 
-from flask import Flask, request, jsonify, send_from_directory, send_file
+import click
+from flask import Flask, Response, request, jsonify, send_from_directory, send_file, stream_with_context
 from flask_cors import CORS
 from werkzeug.exceptions import BadRequest, NotFound, InternalServerError
 
 from app import storage, parseextract_client, normalizer, config_store
 from app.parseextract_client import ParseExtractError
 
+# visit_store, image_hash, batching, sessions and backfill pull in NumPy/Pillow;
+# they are imported where used so CLI commands and dev reloads start fast.
+# gunicorn.conf.py imports them once in the master so workers share them.
+HEAVY_MODULES = ("app.visit_store", "app.image_hash", "app.batching", "app.sessions", "app.backfill")
+
 # Setup logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 
 # Create Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 
 # Enable CORS
-CORS(app, origins=["*"], supports_credentials=True)
+CORS(app, origins=["*"], supports_credentials=True, expose_headers=["X-Last-Event-ID"])
 
 # Setup paths
 BASE_DIR = Path(__file__).resolve().parent
 WEB_DIR = BASE_DIR / 'web'
 
-# Initialize database on startup
+# Initialize database on startup (a no-op once the schema is current)
 with app.app_context():
     storage.init_db()
 
+# Set on SIGTERM (see gunicorn.conf.py): in-flight uploads finish, event
+# streams close so clients reconnect elsewhere, new uploads are refused.
+draining = threading.Event()
+
+def begin_drain() -> None:
+    draining.set()
+    storage.wake_event_streams()
+
 @app.route("/")
 def index():
     """Serve the main web UI"""
@@ -45,6 +61,8 @@ def static_files(filename):
 @app.route("/health")
 def health():
     """Health check endpoint"""
+    if draining.is_set():
+        return jsonify({"status": "draining"}), 503
     return jsonify({"status": "ok"})
 
 # ---- Config endpoints ----
@@ -53,6 +71,13 @@ def get_config():
     """Get current configuration"""
     return jsonify(config_store.load_config())
 
+def _check_dedupe_threshold(value: Any) -> None:
+    from app.image_hash import MAX_THRESHOLD
+    # bool is an int subclass; true must not silently mean 1
+    if value is None or (type(value) is int and 0 <= value <= MAX_THRESHOLD):
+        return
+    raise ValueError(f"dedupe_threshold must be null or an integer from 0 to {MAX_THRESHOLD}")
+
 @app.route('/config', methods=['POST'])
 def set_config():
     """Update configuration"""
@@ -60,8 +85,11 @@ def set_config():
         data = config_store.load_config()
         incoming = request.get_json() or {}
         
+        if 'dedupe_threshold' in incoming:
+            _check_dedupe_threshold(incoming['dedupe_threshold'])
+
         # Update only provided fields
-        for key in ['parsextract_url', 'api_key', 'prompt', 'extra_params', 'stub']:
+        for key in ['parsextract_url', 'api_key', 'prompt', 'extra_params', 'stub', 'dedupe_threshold', 'batching']:
             if key in incoming:
                 data[key] = incoming[key]
         
@@ -76,8 +104,12 @@ def api_list_ingests():
     """List recent ingests"""
     limit = request.args.get('limit', 50, type=int)
     try:
+        # Read before the list, so /events?lastEventId= replays anything the list may have missed
+        last_event_id = storage.latest_event_id()
         ingests = storage.list_ingests(limit=limit)
-        return jsonify(ingests)
+        resp = jsonify(ingests)
+        resp.headers['X-Last-Event-ID'] = str(last_event_id)
+        return resp
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -103,10 +135,212 @@ def api_delete_ingest(ingest_id: int):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# ---- Search ----
+@app.route("/search", methods=['GET'])
+def api_search():
+    """Full-text search over filename, players, meta and extracted text"""
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({"error": "q is required"}), 400
+    try:
+        result = storage.search_ingests(
+            q,
+            limit=request.args.get('limit', 20, type=int),
+            cursor=request.args.get('cursor'),
+        )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Rebuild the full-text search index from all stored ingests"""
+    count = storage.rebuild_search_index()
+    print(f"Indexed {count} ingests.")
+
+@app.cli.command("rebuild-visits")
+def rebuild_visits_command():
+    """Rebuild the analytics visit store from all stored ingests"""
+    from app import visit_store
+    count = visit_store.rebuild(storage.iter_normalized())
+    print(f"Stored {count} visits.")
+
+@app.cli.command("renormalize")
+@click.option("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+@click.option("--chunk-size", type=int, default=500, show_default=True, help="Rows per chunk/transaction")
+def renormalize_command(workers, chunk_size):
+    """Re-run the normalizer on ingests written by an older normalizer version"""
+    from app import backfill
+    backfill.renormalize(workers=workers, chunk_size=chunk_size, report=lambda msg: click.echo(msg, err=True))
+
+# ---- Analytics (columnar visit store) ----
+@app.route("/analytics/leaderboard", methods=['GET'])
+def api_leaderboard():
+    """Top-N players by 3-dart average"""
+    from app import visit_store
+    try:
+        rows = visit_store.leaderboard(
+            n=request.args.get('n', 10, type=int),
+            min_visits=request.args.get('min_visits', 1, type=int),
+            date_from=request.args.get('from'),
+            date_to=request.args.get('to'),
+        )
+        return jsonify(rows)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/analytics/rolling-average", methods=['GET'])
+def api_rolling_average():
+    """Rolling 3-dart average trend for one player"""
+    from app import visit_store
+    player = request.args.get('player', '')
+    if not player:
+        return jsonify({"error": "player is required"}), 400
+    try:
+        return jsonify(visit_store.rolling_average(
+            player,
+            window=request.args.get('window', 30, type=int),
+            date_from=request.args.get('from'),
+            date_to=request.args.get('to'),
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/analytics/histogram", methods=['GET'])
+def api_score_histogram():
+    """Distribution of visit scores (0..180), optionally for one player"""
+    from app import visit_store
+    try:
+        return jsonify(visit_store.score_histogram(
+            player=request.args.get('player') or None,
+            date_from=request.args.get('from'),
+            date_to=request.args.get('to'),
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/batching/stats", methods=['GET'])
+def api_batching_stats():
+    """Requests saved versus added wait for composite batching in this worker"""
+    from app import batching
+    cfg = config_store.load_config().get("batching") or {}
+    if not cfg.get("enabled"):
+        return jsonify({"enabled": False})
+    stats = batching.get_batcher(cfg.get("max_size", 4), cfg.get("window_ms", 400)).stats()
+    return jsonify({"enabled": True, **stats})
+
+# ---- Game sessions ----
+@app.route("/sessions", methods=['POST'])
+def api_create_session():
+    """Start a live game session; pass the returned id as `session_id` to /upload"""
+    from app import sessions
+    return jsonify({"session_id": sessions.new_session()})
+
+@app.route("/sessions/<session_id>", methods=['DELETE'])
+def api_delete_session(session_id: str):
+    """End a game session (its ingests are kept)"""
+    if not storage.delete_session(session_id):
+        return jsonify({"detail": "Not found"}), 404
+    return jsonify({"deleted": True})
+
+# ---- Server-sent events ----
+SSE_HEARTBEAT_SECONDS = 15
+SSE_POLL_SECONDS = 1.0
+# Each open stream holds one worker thread under gthread. Past this many per
+# worker process, /events answers 503 so uploads keep threads to run on.
+# Default: half of GUNICORN_THREADS; raise it when running gevent workers.
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", max(1, int(os.getenv("GUNICORN_THREADS", "16")) // 2)))
+SSE_RETRY_AFTER_SECONDS = 5
+
+_open_streams = 0
+_open_streams_lock = threading.Lock()
+
+def _release_stream() -> None:
+    global _open_streams
+    with _open_streams_lock:
+        _open_streams -= 1
+
+def _sse(event: Dict[str, Any]) -> str:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+@app.route("/events", methods=['GET'])
+def api_events():
+    """
+    Event stream: ingest.created / ingest.updated / ingest.deleted for everyone,
+    upload.progress only for the `client` given in the query string.
+    Resumes after Last-Event-ID (header, or `lastEventId` query parameter).
+    If events after it are no longer retained, a `reset` event tells the
+    client to reload its state, and the stream continues from the latest.
+    503 with Retry-After when this worker already serves SSE_MAX_STREAMS.
+    """
+    global _open_streams
+    client_id = request.args.get('client', '')
+    resume = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    oldest, latest = storage.event_id_range()
+    try:
+        last_id = int(resume) if resume else latest
+    except ValueError:
+        last_id = latest
+    # Ids beyond the latest mean the event log was reset (e.g. a new database)
+    reset = last_id < oldest - 1 or last_id > latest
+    if reset:
+        last_id = latest
+
+    with _open_streams_lock:
+        if _open_streams >= SSE_MAX_STREAMS:
+            return jsonify({"error": "Too many event streams, please retry"}), 503, {"Retry-After": str(SSE_RETRY_AFTER_SECONDS)}
+        _open_streams += 1
+
+    def stream(last_id: int):
+        yield f"retry: 3000\nid: {last_id}\n\n"
+        if reset:
+            yield _sse({"id": last_id, "type": "reset", "data": {}})
+        idle_since = time.monotonic()
+        while not draining.is_set():
+            events = storage.list_events(last_id)
+            for e in events:
+                last_id = e["id"]
+                if e["type"] == "upload.progress" and e["data"].get("client") != client_id:
+                    continue
+                yield _sse(e)
+                idle_since = time.monotonic()
+            if len(events) == 100:
+                continue
+            if time.monotonic() - idle_since >= SSE_HEARTBEAT_SECONDS:
+                yield ": keepalive\n\n"
+                idle_since = time.monotonic()
+            storage.wait_for_events(SSE_POLL_SECONDS)
+
+    resp = Response(stream_with_context(stream(last_id)), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    # Runs when the response is closed, also if the stream never started
+    resp.call_on_close(_release_stream)
+    return resp
+
+def _upload_progress(client_id: str, stage: str, **data: Any) -> None:
+    """Publish an upload stage (received, extracting, normalizing, stored, failed) for one client"""
+    if client_id:
+        storage.publish_event("upload.progress", {"client": client_id, "stage": stage, **data})
+
 # ---- Upload ----
 @app.route("/upload", methods=['POST'])
 def upload_image():
     """Upload and process dart game image"""
+    from app import batching, image_hash, sessions
+    client_id = request.form.get('client_id', '').strip()
+    upload_id = request.form.get('upload_id', '').strip()
+    if draining.is_set():
+        return jsonify({"error": "Server is shutting down, please retry"}), 503, {"Retry-After": "2"}
     try:
         # Check if image file is present
         if 'image' not in request.files:
@@ -137,28 +371,78 @@ def upload_image():
         contents = image_file.read()
         filename = image_file.filename or "image.jpg"
         mime = image_file.content_type or "image/jpeg"
+        _upload_progress(client_id, "received", upload=upload_id, filename=filename, bytes=len(contents))
+
+        # Live game session: extract only what changed since the previous frame
+        session_id = request.form.get('session_id', '').strip()
+        if session_id:
+            _upload_progress(client_id, "extracting", upload=upload_id, session_id=session_id)
+            try:
+                result = sessions.stitch_upload(session_id, contents, filename, mime, players, bust_flag, meta_dict)
+            except ParseExtractError as e:
+                _upload_progress(client_id, "failed", upload=upload_id, error=str(e))
+                return jsonify({"error": str(e)}), 502
+            except sessions.SessionConflict as e:
+                _upload_progress(client_id, "failed", upload=upload_id, error=str(e))
+                return jsonify({"error": str(e)}), 409
+            if result is None:
+                _upload_progress(client_id, "failed", upload=upload_id, error="Unknown session")
+                return jsonify({"detail": "Unknown session"}), 404
+            _upload_progress(client_id, "stored", upload=upload_id, id=result["id"], mode=result["mode"])
+            return jsonify({"filename": filename, "session_id": session_id, **result})
+
+        # Near-duplicate check (opt-in): reuse the extraction of a practically
+        # identical upload. Hashes are stored either way, so enabling it later
+        # also matches earlier uploads.
+        dhash = image_hash.dhash(contents)
+        duplicate_of: Optional[int] = None
+        raw: Optional[Dict[str, Any]] = None
+        cfg = config_store.load_config()
+        threshold = cfg.get("dedupe_threshold")
+        if dhash is not None and type(threshold) is int and 0 <= threshold <= image_hash.MAX_THRESHOLD:
+            hit = image_hash.find_duplicate(dhash, threshold)
+            if hit:
+                original = storage.get_ingest(hit[0])
+                if original:
+                    duplicate_of = original["id"]
+                    raw = original["raw"]
 
         # Call ParseExtract
-        try:
-            raw = parseextract_client.call_parseextract(contents, filename, mime=mime)
-        except ParseExtractError as e:
-            return jsonify({"error": str(e)}), 502
+        _upload_progress(client_id, "extracting", upload=upload_id, duplicate_of=duplicate_of)
+        if raw is None:
+            batch_cfg = cfg.get("batching") or {}
+            try:
+                if batch_cfg.get("enabled"):
+                    raw = batching.call_batched(contents, filename, mime, batch_cfg)
+                else:
+                    raw = parseextract_client.call_parseextract(contents, filename, mime=mime)
+            except ParseExtractError as e:
+                _upload_progress(client_id, "failed", upload=upload_id, error=str(e))
+                return jsonify({"error": str(e)}), 502
 
         # Normalize
+        _upload_progress(client_id, "normalizing", upload=upload_id)
         normalized = normalizer.normalize_to_dartsmind(raw, players, bust_flag, meta=meta_dict)
 
         # Persist
-        new_id = storage.insert_ingest(filename, players, bust_flag, meta_dict, raw, normalized)
+        new_id = storage.insert_ingest(
+            filename, players, bust_flag, meta_dict, raw, normalized,
+            dhash=image_hash.to_bytes(dhash) if dhash is not None else None,
+            duplicate_of=duplicate_of,
+        )
+        _upload_progress(client_id, "stored", upload=upload_id, id=new_id)
 
         return jsonify({
             "id": new_id,
             "filename": filename,
+            "duplicate_of": duplicate_of,
             "raw": raw,
             "normalized": normalized,
         })
 
     except Exception as e:
         app.logger.error(f"Upload error: {str(e)}")
+        _upload_progress(client_id, "failed", upload=upload_id, error=str(e))
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
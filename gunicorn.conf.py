@@ -0,0 +1,66 @@
+"""
+Production serving profile:  gunicorn -c gunicorn.conf.py main:app
+
+Every setting can be overridden through the environment (see .env.example).
+"""
+import importlib
+import multiprocessing
+import os
+import signal
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+
+# Threaded workers: uploads block on ParseExtract for seconds and /events
+# holds a connection open, so each worker needs many concurrent slots.
+# Streams are capped at SSE_MAX_STREAMS per worker (half the threads by
+# default) so they can't take every thread from uploads. Set
+# GUNICORN_WORKER_CLASS=gevent (with gevent installed) and raise
+# SSE_MAX_STREAMS for very many concurrent event streams.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))  # gevent only
+
+# Load the app once in the master; workers fork from it and share the
+# imported modules copy-on-write. storage.init_db() thereby runs once too.
+preload_app = True
+
+# ParseExtract calls time out after 60 s; give in-flight uploads room to
+# finish after SIGTERM before a worker is killed.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "90"))
+keepalive = 5
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-") or None  # empty disables
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+
+def when_ready(server):
+    # The app, and with it the schema migration, was loaded once in the
+    # master (preload_app). Import the NumPy/Pillow feature modules here too,
+    # so every worker inherits them instead of importing its own copy.
+    from flask_app import HEAVY_MODULES
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
+
+def post_fork(server, worker):
+    # Nothing opened in the master may be reused by a worker: SQLite
+    # connections are opened per call, but the HTTP keep-alive pool is not.
+    from app import parseextract_client
+    parseextract_client.reset_http_pool()
+
+
+def post_worker_init(worker):
+    # gunicorn's own SIGTERM handler stops accepting and waits up to
+    # graceful_timeout for in-flight requests. Chain ours in front so
+    # long-lived event streams end instead of holding the worker open.
+    from flask_app import begin_drain
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        begin_drain()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
@@ -1,4 +1,4 @@
 #!/usr/bin/env bash
 set -euo pipefail
 export $(grep -v '^#' .env | xargs -d '\n' -r) || true
-exec python app.py
+exec gunicorn -c gunicorn.conf.py main:app
@@ -0,0 +1,105 @@
+"""
+Composite batching benchmark: ParseExtract requests saved versus added latency.
+
+    python scripts/bench_batching.py [--uploads 40] [--rate 8] [--latency 1.5] [--windows 0,250,500,1000]
+
+Uploads arrive as a Poisson stream and go through a real CompositeBatcher
+(composites are built and split as in production). Only the ParseExtract
+call is simulated: it sleeps --latency seconds (plus --per-tile seconds per
+extra tile) and answers every tile, so no API key or network is needed.
+For each window the batcher runs with the app's default pool of 4 threads.
+"""
+import argparse
+import io
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from app import batching  # noqa: E402
+
+
+def _screenshot(n: int) -> bytes:
+    img = Image.new("RGB", (720, 1280), (20, 24, 32))
+    ImageDraw.Draw(img).text((40, 40), f"Upload {n}", fill="white")
+    out = io.BytesIO()
+    img.save(out, "PNG")
+    return out.getvalue()
+
+
+def _fake_parseextract(latency: float, per_tile: float):
+    def call(image_bytes: bytes, filename: str, mime: str="image/jpeg", prompt: Any=None) -> Dict[str, Any]:
+        m = re.search(r"grid of (\d+) separate", prompt or "")
+        tiles = int(m.group(1)) if m else 1
+        time.sleep(latency + per_tile * (tiles - 1))
+        if m:
+            return {"tiles": [{"tile": i, "text": "R1: 60 (441)"} for i in range(1, tiles + 1)]}
+        return {"text": "R1: 60 (441)"}
+    return call
+
+
+def run(window_ms: int, args: argparse.Namespace, images: List[bytes]) -> Dict[str, Any]:
+    batcher = batching.CompositeBatcher(max_size=args.max_size, window_ms=window_ms)
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def upload(b: bytes, n: int) -> None:
+        started = time.monotonic()
+        batcher.submit(b, f"upload-{n}.png", "image/png")
+        with lock:
+            latencies.append(time.monotonic() - started)
+
+    rng = random.Random(args.seed)
+    threads = []
+    for n, b in enumerate(images):
+        t = threading.Thread(target=upload, args=(b, n))
+        t.start()
+        threads.append(t)
+        time.sleep(rng.expovariate(args.rate))
+    for t in threads:
+        t.join()
+
+    s = batcher.stats()
+    latencies.sort()
+    return {
+        "window_ms": window_ms,
+        "requests": s["requests"],
+        "saved": s["requests_saved"],
+        "wait_ms": s["avg_added_wait_ms"],
+        "mean": statistics.mean(latencies),
+        "p95": latencies[max(0, int(len(latencies) * 0.95) - 1)],
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--uploads", type=int, default=40)
+    ap.add_argument("--rate", type=float, default=8.0, help="mean uploads per second")
+    ap.add_argument("--latency", type=float, default=1.5, help="simulated seconds per ParseExtract call")
+    ap.add_argument("--per-tile", type=float, default=0.0, help="extra simulated seconds per additional tile")
+    ap.add_argument("--max-size", type=int, default=4)
+    ap.add_argument("--windows", default="0,250,500,1000", help="comma-separated window_ms values")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    batching.call_parseextract = _fake_parseextract(args.latency, args.per_tile)
+    batching.resolve_prompt = lambda cfg: "Extract the scores."
+    images = [_screenshot(n) for n in range(args.uploads)]
+
+    print(f"{args.uploads} uploads at ~{args.rate:g}/s, {args.latency:g} s per call, max_size {args.max_size}")
+    print(f"{'window ms':>10}{'requests':>10}{'saved':>8}{'wait ms':>10}{'mean s':>9}{'p95 s':>8}")
+    for w in (int(x) for x in args.windows.split(",")):
+        r = run(w, args, images)
+        print(f"{r['window_ms']:>10}{r['requests']:>10}{r['saved']:>8}{r['wait_ms']:>10.0f}{r['mean']:>9.2f}{r['p95']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
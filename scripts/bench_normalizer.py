@@ -0,0 +1,150 @@
+"""
+Normalizer benchmark: normalize_to_dartsmind over large synthetic extractions.
+
+    python scripts/bench_normalizer.py [--lines 100000] [--repeat 5]
+
+Each input shape (tokens, data.rounds, single-player text, two-player named
+text) is built with --lines visits and normalized --repeat times; the best
+time is reported. The same inputs also go through `baseline_normalize`, a
+copy of the normalizer before the single-pass rewrite (NORMALIZER_VERSION 1),
+for the ratio in the last column. The baseline parses no data.rounds at all
+and puts every visit in one leg, so it does less work than the current one.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.normalizer import normalize_to_dartsmind  # noqa: E402
+
+# ---- Baseline: app/normalizer.py before the rewrite, trimmed to the normalize path ----
+def _baseline_visits(raw: dict) -> List[dict]:
+    visits: List[dict] = []
+    tokens = raw.get("tokens")
+    if isinstance(tokens, list):
+        for t in tokens:
+            visits.append({
+                "round": int(t.get("round", len(visits)+1)),
+                "scoreOfVisit": int(t.get("visit", 0)),
+                "scoreAfterVisit": int(t.get("after", 0)),
+                "dartsThrown": t.get("darts", []),
+            })
+        return visits
+
+    text = raw.get("text", "")
+    if isinstance(text, str):
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if ":" in line and "(" in line and ")" in line:
+                try:
+                    left, rest = line.split(":", 1)
+                    visit_str, after_paren = rest.split("(", 1)
+                    visit = int("".join(ch for ch in visit_str if ch.isdigit()))
+                    after = int("".join(ch for ch in after_paren if ch.isdigit()))
+                    visits.append({
+                        "round": len(visits)+1,
+                        "scoreOfVisit": visit,
+                        "scoreAfterVisit": after,
+                        "dartsThrown": [],
+                    })
+                except Exception:
+                    continue
+    return visits
+
+
+def baseline_normalize(raw: Dict[str, Any], player_names: List[str]) -> Dict[str, Any]:
+    visits = _baseline_visits(raw)
+    leg = {"legNumber": 1, "visits": visits}
+    leg.update({
+        "average": None,
+        "checkoutPercent": None,
+        "dartsThrown": sum(len(v.get("dartsThrown", [])) or 3 for v in visits) if visits else None,
+        "bestVisit": max((v.get("scoreOfVisit", 0) for v in visits), default=None),
+    })
+    return {"players": [{"playerName": n, "bust": False, "legs": [leg]} for n in player_names], "meta": {}}
+
+
+# ---- Inputs ----
+VISITS = (60, 100, 45, 81, 140, 26, 41, 85, 57, 180)
+
+
+def _legs(lines: int, players: int) -> List[Tuple[int, int, int, int]]:
+    """(player, round, visit, after) for `lines` visits, legs of 501 played out in turn."""
+    out = []
+    remaining = [501] * players
+    rnd = 1
+    k = 0
+    while len(out) < lines:
+        p = len(out) % players
+        visit = VISITS[k % len(VISITS)]
+        k += 1
+        if visit > remaining[p] - 2:
+            visit = remaining[p]
+        remaining[p] -= visit
+        out.append((p, rnd, visit, remaining[p]))
+        if remaining[p] == 0:
+            remaining = [501] * players
+            rnd = 1
+        elif p == players - 1:
+            rnd += 1
+    return out
+
+
+def shapes(lines: int) -> Dict[str, Tuple[Dict[str, Any], List[str]]]:
+    one = _legs(lines, 1)
+    two = _legs(lines, 2)
+    names = ["Alice", "Bob"]
+    return {
+        "tokens": (
+            {"tokens": [{"round": r, "visit": v, "after": a, "darts": [20, 20, 20]} for _, r, v, a in one]},
+            ["Alice"],
+        ),
+        "data.rounds": (
+            {"data": {"rounds": [{"player": names[p], "round": r, "score": v, "remaining": a} for p, r, v, a in two]}},
+            names,
+        ),
+        "text": (
+            {"text": "\n".join(f"R{r}: {v} ({a})" for _, r, v, a in one)},
+            ["Alice"],
+        ),
+        "text, 2 players": (
+            {"text": "\n".join(f"{names[p]} R{r}: {v} [20, 20, 20] ({a})" for p, r, v, a in two)},
+            names,
+        ),
+    }
+
+
+def best_of(repeat: int, fn: Callable[[], Any]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--lines", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    print(f"{args.lines} visits per input, best of {args.repeat}")
+    print(f"{'':<18}{'current':>12}{'':>14}{'baseline':>12}{'ratio':>8}")
+    for name, (raw, players) in shapes(args.lines).items():
+        t = best_of(args.repeat, lambda: normalize_to_dartsmind(raw, players))
+        base: Optional[float] = None
+        if len(baseline_normalize(raw, players)["players"][0]["legs"][0]["visits"]) == args.lines:
+            base = best_of(args.repeat, lambda: baseline_normalize(raw, players))
+        line = f"{name:<18}{t * 1000:>9.1f} ms{args.lines / t / 1e6:>8.2f} M/s"
+        line += f"{base * 1000:>12.1f} ms{t / base:>7.2f}x" if base else f"{'not parsed':>15}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Local serving benchmark: cold-start time and per-worker memory.
+
+    python scripts/bench_serving.py [--runs 5] [--workers 2] [--port 5055]
+
+Cold start is the wall time of a fresh interpreter importing flask_app (what
+every CLI command and dev reload pays). Memory is read from /proc for the
+master and each worker of `gunicorn -c gunicorn.conf.py main:app`: RSS counts
+shared pages in full, PSS splits them between the processes sharing them,
+so PSS is what a worker really adds. Linux only.
+"""
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def cold_start(runs: int) -> List[float]:
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import flask_app"], cwd=ROOT, check=True)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def _memory_kb(pid: int) -> Dict[str, int]:
+    out = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                out[key] = int(rest.split()[0])
+    return out
+
+
+def _children(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+def _wait_healthy(proc: subprocess.Popen, url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {proc.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=1) as r:
+                if r.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not become healthy within {timeout:.0f}s")
+
+
+def worker_memory(workers: int, port: int) -> None:
+    env = dict(os.environ, PORT=str(port), GUNICORN_WORKERS=str(workers), GUNICORN_ACCESS_LOG="", LOG_LEVEL="WARNING")
+    started = time.perf_counter()
+    master = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"], cwd=ROOT, env=env)
+    try:
+        _wait_healthy(master, f"http://127.0.0.1:{port}/health", 30)
+        print(f"gunicorn ready in {time.perf_counter() - started:.2f}s")
+        # Let every worker finish booting before measuring
+        deadline = time.monotonic() + 10
+        while len(_children(master.pid)) < workers and time.monotonic() < deadline:
+            time.sleep(0.1)
+        # Touch each worker once so lazily allocated request state is counted
+        for _ in range(workers * 4):
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=5).read()
+
+        print(f"{'process':<16}{'RSS MiB':>10}{'PSS MiB':>10}")
+        m = _memory_kb(master.pid)
+        print(f"{'master ' + str(master.pid):<16}{m['Rss'] / 1024:>10.1f}{m['Pss'] / 1024:>10.1f}")
+        pss = []
+        for pid in _children(master.pid):
+            w = _memory_kb(pid)
+            pss.append(w["Pss"])
+            print(f"{'worker ' + str(pid):<16}{w['Rss'] / 1024:>10.1f}{w['Pss'] / 1024:>10.1f}")
+        if pss:
+            print(f"mean worker PSS {statistics.mean(pss) / 1024:.1f} MiB")
+    finally:
+        if master.poll() is None:
+            master.send_signal(signal.SIGTERM)
+            master.wait(timeout=120)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--runs", type=int, default=5, help="cold-start repetitions")
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--port", type=int, default=5055)
+    args = ap.parse_args()
+
+    times = cold_start(args.runs)
+    print(f"cold start (import flask_app): median {statistics.median(times) * 1000:.0f} ms, "
+          f"min {min(times) * 1000:.0f} ms over {args.runs} runs")
+    worker_memory(args.workers, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Visit store benchmark: analytics queries over a large synthetic store.
+
+    python scripts/bench_visit_store.py [--visits 10000000] [--players 200] [--deleted 20] [--repeat 7]
+
+Column files for --visits random visits (100 per ingest, dates spread over
+three years in ingest order) are written straight into a temporary store,
+bypassing JSON parsing so setup stays fast; the zone map and committed row
+count are built as an append would. --deleted ingests are then deleted, so
+the tombstone masking is part of every query. Times are the best of --repeat.
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+
+from app import visit_store  # noqa: E402
+
+
+def build(visits: int, players: int, deleted: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    ingests = -(-visits // 100)
+    first_day = visit_store._filter_day("2023-01-01")
+    cols = {
+        "ingest_id": np.repeat(np.arange(1, ingests + 1), 100)[:visits],
+        "player_id": rng.integers(0, players, visits),
+        "day": first_day + np.repeat(np.sort(rng.integers(0, 3 * 365, ingests)), 100)[:visits],
+        "leg": rng.integers(1, 6, visits),
+        "round": rng.integers(1, 20, visits),
+        "score": rng.integers(0, 181, visits),
+        "after": rng.integers(0, 502, visits),
+        "darts": rng.integers(1, 4, visits),
+    }
+    for name, dtype in visit_store.COLUMNS.items():
+        cols[name].astype(dtype).tofile(visit_store._col_path(name))
+    visit_store._write_json(visit_store._players_path(), {f"Player {i}": i for i in range(players)})
+    visit_store._update_zones(0, visits)
+    visit_store._write_json(visit_store._state_path(), {"rows": visits})
+    for ingest_id in rng.choice(np.arange(1, ingests + 1), size=min(deleted, ingests), replace=False):
+        visit_store.mark_deleted(int(ingest_id))
+
+
+def best_of(repeat: int, fn: Callable[[], Any]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--visits", type=int, default=10_000_000)
+    ap.add_argument("--players", type=int, default=200)
+    ap.add_argument("--deleted", type=int, default=20, help="ingests to delete before querying")
+    ap.add_argument("--repeat", type=int, default=7)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        visit_store.STORE_DIR = Path(tmp)
+        started = time.perf_counter()
+        build(args.visits, args.players, args.deleted, args.seed)
+        print(f"{args.visits:,} visits, {args.players} players, {args.deleted} deleted ingests "
+              f"(built in {time.perf_counter() - started:.1f}s), best of {args.repeat}")
+
+        queries = {
+            "leaderboard": lambda: visit_store.leaderboard(),
+            "leaderboard, 2024": lambda: visit_store.leaderboard(date_from="2024-01-01", date_to="2024-12-31"),
+            "histogram": lambda: visit_store.score_histogram(),
+            "histogram, player": lambda: visit_store.score_histogram("Player 7"),
+            "rolling average": lambda: visit_store.rolling_average("Player 7"),
+        }
+        for name, fn in queries.items():
+            print(f"{name:<20}{best_of(args.repeat, fn) * 1000:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
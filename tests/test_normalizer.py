@@ -0,0 +1,165 @@
+import random
+
+from app.normalizer import (
+    _coerce_entry,
+    _entries_from_dicts,
+    _split_head,
+    infer_visits_from_text,
+    new_visits,
+    normalize_to_dartsmind,
+)
+
+
+def _visits(doc, player=0, leg=0):
+    return [(v["round"], v["scoreOfVisit"], v["scoreAfterVisit"]) for v in doc["players"][player]["legs"][leg]["visits"]]
+
+
+# ---- Visit heads ----
+
+def test_split_head_round_only():
+    assert _split_head("R12", ()) == (None, 12)
+    assert _split_head(" r3 ", ()) == (None, 3)
+
+
+def test_split_head_player_and_round():
+    assert _split_head("Alice R3", ()) == ("Alice", 3)
+    assert _split_head("Player 1 R2", ()) == ("Player 1", 2)
+
+
+def test_split_head_name_ending_in_r_is_not_split():
+    assert _split_head("Peter", ()) == ("Peter", None)
+    assert _split_head("Amber", ()) == ("Amber", None)
+
+
+def test_split_head_name_ending_in_digit_is_not_a_round():
+    assert _split_head("Player 1", ()) == ("Player 1", None)
+
+
+def test_split_head_known_name_wins():
+    assert _split_head("R2D2", ()) == ("R2D2", None)
+    assert _split_head("Team R2", ("Team R2",)) == ("Team R2", None)
+    assert _split_head("Team R2", ()) == ("Team", 2)
+
+
+# ---- Text ----
+
+def test_text_visit_lines():
+    raw = {"text": "R1: 60 (441)\nR2: 100 [20, 60, 20] (341)\nnoise\nR3: 45 (296)"}
+    assert infer_visits_from_text(raw) == [
+        {"round": 1, "scoreOfVisit": 60, "scoreAfterVisit": 441, "dartsThrown": []},
+        {"round": 2, "scoreOfVisit": 100, "scoreAfterVisit": 341, "dartsThrown": [20, 60, 20]},
+        {"round": 3, "scoreOfVisit": 45, "scoreAfterVisit": 296, "dartsThrown": []},
+    ]
+
+
+def test_text_numbered_player_names_are_attributed():
+    doc = normalize_to_dartsmind({"text": "Player 2: 60 (441)\nPlayer 1: 100 (401)"}, ["Player 1", "Player 2"])
+    assert _visits(doc, 0) == [(1, 100, 401)]
+    assert _visits(doc, 1) == [(1, 60, 441)]
+
+
+def test_text_names_ending_in_r():
+    doc = normalize_to_dartsmind({"text": "Peter: 60 (441)\nAmber: 45 (456)\nPeter: 100 (341)"}, ["Peter", "Amber"])
+    assert _visits(doc, 0) == [(1, 60, 441), (2, 100, 341)]
+    assert _visits(doc, 1) == [(1, 45, 456)]
+
+
+def test_text_leg_headers():
+    doc = normalize_to_dartsmind({"text": "Leg 1\nR1: 60 (441)\nLeg 2\nR1: 100 (401)"}, ["Alice"])
+    legs = doc["players"][0]["legs"]
+    assert [leg["legNumber"] for leg in legs] == [1, 2]
+    assert _visits(doc, 0, 1) == [(1, 100, 401)]
+
+
+# ---- Legs ----
+
+def test_checkout_starts_next_leg_and_summaries():
+    tokens = [
+        {"round": 1, "visit": 180, "after": 321, "darts": [60, 60, 60]},
+        {"round": 2, "visit": 180, "after": 141, "darts": [60, 60, 60]},
+        {"round": 3, "visit": 100, "after": 41, "darts": [20, 20, 60]},
+        {"round": 4, "visit": 41, "after": 0, "darts": [1, 40]},
+        {"round": 1, "visit": 60, "after": 441, "darts": [20, 20, 20]},
+    ]
+    legs = normalize_to_dartsmind({"tokens": tokens}, ["Alice"])["players"][0]["legs"]
+    assert [leg["legNumber"] for leg in legs] == [1, 2]
+    first = legs[0]
+    assert first["dartsThrown"] == 11
+    assert first["average"] == round(3 * 501 / 11, 2)
+    assert first["bestVisit"] == 180
+    # 141 and 41 were checkout chances, 41 was taken
+    assert first["checkoutPercent"] == 50.0
+    assert legs[1]["checkoutPercent"] is None
+
+
+def test_two_players_assigned_by_remaining_score():
+    # Bob throws twice in a row as far as the order goes (Alice's second visit is missing)
+    tokens = [
+        {"visit": 60, "after": 441},
+        {"visit": 45, "after": 456},
+        {"visit": 100, "after": 356},
+    ]
+    doc = normalize_to_dartsmind({"tokens": tokens}, ["Alice", "Bob"])
+    assert _visits(doc, 0) == [(1, 60, 441)]
+    assert _visits(doc, 1) == [(1, 45, 456), (2, 100, 356)]
+
+
+def test_explicit_player_and_loose_types():
+    rounds = [
+        {"player": "bob", "round": "R1", "score": "45", "remaining": "456", "darts": ["5", 20, "T20"]},
+        {"name": "Alice", "round": 1.0, "visit": 60, "after": 441},
+    ]
+    doc = normalize_to_dartsmind({"data": {"rounds": rounds}}, ["Alice", "Bob"])
+    assert _visits(doc, 0) == [(1, 60, 441)]
+    assert _visits(doc, 1) == [(1, 45, 456)]
+    assert doc["players"][1]["legs"][0]["visits"][0]["dartsThrown"] == [5, 20, 20]
+
+
+def test_names_from_extraction_when_form_has_none():
+    raw = {"data": {"players": ["Ann", "Ben"], "rounds": [{"player": "Ben", "visit": 60, "after": 441}]}}
+    doc = normalize_to_dartsmind(raw, [])
+    assert [p["playerName"] for p in doc["players"]] == ["Ann", "Ben"]
+    assert _visits(doc, 1) == [(1, 60, 441)]
+
+
+def test_well_formed_tokens_match_the_coerced_entries():
+    rng = random.Random(5)
+    tokens = []
+    for _ in range(500):
+        t = {"visit": rng.randint(0, 180), "after": rng.randint(0, 501), "darts": rng.choice([[20, 20, 20], [], [5]])}
+        if rng.random() < 0.7:
+            t["round"] = rng.randint(0, 5)
+        if rng.random() < 0.2:
+            t["player"] = rng.choice(["Alice", 1])
+        if rng.random() < 0.2:
+            t["leg"] = rng.randint(1, 3)
+        tokens.append(t)
+    assert list(_entries_from_dicts(tokens)) == [_coerce_entry(t) for t in tokens]
+
+
+def test_messy_tokens_are_coerced():
+    tokens = [{"round": "1", "visit": "60", "after": 441.0, "darts": ["20", 20, 20]}, "junk"]
+    doc = normalize_to_dartsmind({"tokens": tokens}, ["Alice"])
+    assert doc["players"][0]["legs"][0]["visits"] == [
+        {"round": 1, "scoreOfVisit": 60, "scoreAfterVisit": 441, "dartsThrown": [20, 20, 20]},
+    ]
+
+
+def test_tokens_with_player():
+    tokens = [{"player": "Bob", "visit": 60, "after": 441, "darts": []}]
+    doc = normalize_to_dartsmind({"tokens": tokens}, ["Alice", "Bob"])
+    assert _visits(doc, 1) == [(1, 60, 441)]
+
+
+# ---- Sessions ----
+
+def test_new_visits_returns_only_appended_visits():
+    names = ["Alice", "Bob"]
+    first = {"text": "Alice R1: 60 (441)\nBob R1: 45 (456)"}
+    second = {"frames": [first, {"text": "Alice R2: 100 (341)"}]}
+    before = normalize_to_dartsmind(first, names)
+    delta = new_visits(before, normalize_to_dartsmind(second, names))
+    assert delta["players"][0]["legs"] == [
+        {"legNumber": 1, "visits": [{"round": 2, "scoreOfVisit": 100, "scoreAfterVisit": 341, "dartsThrown": []}]},
+    ]
+    assert delta["players"][1]["legs"] == []
@@ -0,0 +1,69 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from app import sessions, storage, visit_store
+
+
+@pytest.fixture(autouse=True)
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "DB_PATH", tmp_path / "data.db")
+    monkeypatch.setattr(visit_store, "STORE_DIR", tmp_path / "visits")
+    storage.init_db()
+
+
+def _frame(*rows):
+    """A 256x400 white screen with a black visit row at each of the given y offsets."""
+    img = Image.new("RGB", (256, 400), "white")
+    draw = ImageDraw.Draw(img)
+    for y in rows:
+        draw.rectangle([0, y, 255, y + 40], fill="black")
+    out = io.BytesIO()
+    img.save(out, "PNG")
+    return out.getvalue()
+
+
+def _upload(session_id, contents):
+    return sessions.stitch_upload(session_id, contents, "frame.png", "image/png", ["Alice"], False, {})
+
+
+def test_new_rows_are_sent_as_a_delta(monkeypatch):
+    sent = []
+    monkeypatch.setattr(sessions, "call_parseextract", lambda b, name, mime: sent.append(name) or {"text": ""})
+    session_id = sessions.new_session()
+    assert _upload(session_id, _frame(0))["mode"] == "full"
+    assert _upload(session_id, _frame(0))["mode"] == "unchanged"
+    assert _upload(session_id, _frame(0, 100))["mode"] == "partial"
+    assert sent == ["frame.png", "delta-frame.png"]
+
+
+def test_a_frame_that_loses_the_race_is_diffed_again(monkeypatch):
+    session_id = sessions.new_session()
+    calls = []
+
+    def extract(contents, name, mime):
+        calls.append(name)
+        if len(calls) == 2:
+            # Another upload to the session is stored while this one is extracted
+            _upload(session_id, _frame(0, 100))
+        return {"text": "", "call": len(calls)}
+
+    monkeypatch.setattr(sessions, "call_parseextract", extract)
+    first = _upload(session_id, _frame(0))
+    result = _upload(session_id, _frame(0, 100, 200))
+    assert result["mode"] == "partial"
+    # The frame stored in between is kept, and the retry only sends what it lacks
+    frames = storage.get_ingest(first["id"])["raw"]["frames"]
+    assert [f["call"] for f in frames] == [1, 3, 4]
+    session = storage.get_session(session_id)
+    assert session["frame_meta"]["shape"] == [400, 256]
+
+
+def test_gives_up_when_other_uploads_keep_winning(monkeypatch):
+    session_id = sessions.new_session()
+    monkeypatch.setattr(sessions, "call_parseextract", lambda b, name, mime: {"text": ""})
+    _upload(session_id, _frame(0))
+    monkeypatch.setattr(storage, "save_session_frame", lambda *args, **kwargs: None)
+    with pytest.raises(sessions.SessionConflict):
+        _upload(session_id, _frame(0, 100))
@@ -0,0 +1,155 @@
+import numpy as np
+import pytest
+
+from app import visit_store
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(visit_store, "STORE_DIR", tmp_path)
+    monkeypatch.setattr(visit_store, "CHUNK_ROWS", 4)
+    return tmp_path
+
+
+def _doc(scores, player="Alice", leg=1):
+    return {"players": [{"playerName": player, "legs": [{"legNumber": leg, "visits": [
+        {"round": i + 1, "scoreOfVisit": s, "scoreAfterVisit": 0, "dartsThrown": [20, 20, 20]}
+        for i, s in enumerate(scores)
+    ]}]}]}
+
+
+def _add(ingest_id, scores, player="Alice", day="2026-01-01"):
+    visit_store.append_ingest(ingest_id, _doc(scores, player), {"matchDate": day})
+
+
+def _counts(player=None, **filters):
+    counts = visit_store.score_histogram(player, **filters)["counts"]
+    return {s: c for s, c in enumerate(counts) if c}
+
+
+# ---- Tombstones ----
+
+def test_delete_hides_every_row_of_the_ingest():
+    _add(1, [60, 60])
+    _add(2, [100])
+    visit_store.mark_deleted(1)
+    assert _counts() == {100: 1}
+
+
+def test_replace_hides_only_rows_written_before_it():
+    _add(1, [60, 60])
+    _add(2, [100])
+    visit_store.replace_ingests([(1, _doc([45, 45, 45]), {"matchDate": "2026-01-01"})])
+    assert _counts() == {45: 3, 100: 1}
+    visit_store.replace_ingests([(1, _doc([180]), {"matchDate": "2026-01-01"})])
+    assert _counts() == {100: 1, 180: 1}
+
+
+def test_replace_does_not_revive_a_deleted_ingest():
+    _add(1, [60])
+    visit_store.mark_deleted(1)
+    visit_store.replace_ingests([(1, _doc([100]), {"matchDate": "2026-01-01"})])
+    assert _counts() == {}
+
+
+# ---- Zone map ----
+
+def test_zone_map_per_chunk():
+    _add(1, [60, 60, 60], day="2026-01-01")
+    _add(2, [100, 100], "Bob", day="2026-01-03")
+    zones = visit_store._zones(visit_store._row_count())
+    jan1 = visit_store._filter_day("2026-01-01")
+    assert zones.tolist() == [
+        [jan1, jan1 + 2, 0, 1, 1, 2],
+        [jan1 + 2, jan1 + 2, 1, 1, 2, 2],
+    ]
+
+
+def test_pruned_chunks_are_not_read():
+    _add(1, [60] * 4, day="2026-01-01")
+    _add(2, [100] * 4, day="2026-02-01")
+    _add(3, [140] * 4, day="2026-03-01")
+    sel = visit_store._select(date_from="2026-02-01", date_to="2026-02-28")
+    # Only the middle chunk survives, and it matches as a whole, so it needs no mask
+    assert sel["parts"] == [(4, 8, None)]
+    assert _counts(date_from="2026-02-01", date_to="2026-02-28") == {100: 4}
+
+
+def test_straddling_and_tombstoned_chunks_are_masked():
+    _add(1, [60, 60], day="2026-01-01")
+    _add(2, [100, 100], day="2026-02-01")
+    _add(3, [140] * 4, day="2026-02-01")
+    visit_store.mark_deleted(3)
+    sel = visit_store._select(date_from="2026-02-01")
+    assert [(lo, hi, idx.tolist()) for lo, hi, idx in sel["parts"]] == [(0, 4, [2, 3]), (4, 8, [])]
+    assert _counts(date_from="2026-02-01") == {100: 2}
+
+
+@pytest.mark.parametrize("zone_map", [True, False])
+def test_leaderboard_matches_a_plain_recount(store, zone_map):
+    rng = np.random.default_rng(3)
+    expected = {}
+    for i in range(1, 30):
+        player = f"P{i % 3}"
+        scores = rng.integers(0, 181, rng.integers(1, 6)).tolist()
+        _add(i, scores, player)
+        if i % 5:
+            expected.setdefault(player, []).extend(scores)
+        else:
+            visit_store.mark_deleted(i)
+    if not zone_map:
+        # Every chunk is then checked against all tombstones
+        (store / "zonemap.bin").unlink()
+    board = {row["playerName"]: row for row in visit_store.leaderboard(n=10)}
+    assert board.keys() == expected.keys()
+    for player, scores in expected.items():
+        assert board[player]["visits"] == len(scores)
+        assert board[player]["bestVisit"] == max(scores)
+        assert board[player]["average"] == round(sum(scores) / len(scores), 2)
+
+
+# ---- Dates ----
+
+def test_rolling_average_is_in_match_date_order():
+    _add(1, [60], day="2026-01-05")
+    _add(2, [100], day="2026-01-01")
+    _add(3, [20], day="2026-01-05")
+    points = visit_store.rolling_average("Alice", window=2)["points"]
+    assert points == [
+        {"date": "2026-01-01", "visits": 1, "average": 100.0},
+        {"date": "2026-01-05", "visits": 3, "average": 40.0},
+    ]
+
+
+def test_invalid_date_filter_is_rejected():
+    _add(1, [60])
+    with pytest.raises(ValueError):
+        visit_store.leaderboard(date_from="05/01/2026")
+
+
+# ---- Crash safety ----
+
+def test_rows_past_the_committed_count_are_ignored_and_dropped(store):
+    _add(1, [60, 60])
+    # An append that died after writing part of one column
+    with open(store / "ingest_id.bin", "ab") as f:
+        f.write(np.asarray([9, 9, 9], dtype=np.int64).tobytes())
+    assert _counts() == {60: 2}
+    assert visit_store.leaderboard()[0]["visits"] == 2
+    _add(2, [100])
+    assert _counts() == {60: 2, 100: 1}
+    assert visit_store._column("ingest_id", 3).tolist() == [1, 1, 2]
+
+
+def test_rebuild_replaces_the_store_and_skips_appends_it_covered():
+    _add(1, [60])
+    _add(2, [100])
+    visit_store.mark_deleted(2)
+    written = visit_store.rebuild([[(1, _doc([45]), {}), (3, _doc([140]), {})]])
+    assert written == 2
+    assert _counts() == {45: 1, 140: 1}
+    # An append for an ingest the rebuild already read is dropped
+    _add(3, [140])
+    assert _counts() == {45: 1, 140: 1}
+    _add(4, [180])
+    assert _counts() == {45: 1, 140: 1, 180: 1}